@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the byte conversion helpers
+
+Times Hex2Str, Hex2Ascii and uptime against the former per-byte loops on the
+string style fields of simulated frames. The former helpers are reproduced
+verbatim, including their debug log call, so both sides pay the same logging
+cost. Output equivalence is covered by tests/test_jkbmsdecode.py.
+
+    python benchmarks/bench_convert.py
+"""
+import logging
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from jkbms.jkbms_mapping import InfoResponseMapping  # noqa: E402
+from jkbms.jkbmsdecode import Hex2Ascii, Hex2Str, RecordDecoder, uptime  # noqa: E402
+from jkbms.protocol import getProtocol  # noqa: E402
+from jkbms.transport import SimulatedTransport  # noqa: E402
+
+log = logging.getLogger('JKBMS-BT')
+
+NUMBER = 20000
+
+
+def hex2AsciiLoop(hexString):
+    answer = ""
+    for x in hexString:
+        if x != 0:
+            # Ignore 0x00 results
+            answer += f"{x:c}"
+
+    log.debug("Hex %s decoded to %s", hexString, answer)
+
+    return answer
+
+
+def hex2StrLoop(hexString):
+    answer = ""
+    for x in hexString:
+        answer += f"{x:02x}"
+
+    log.debug("Hex %s decoded to %s", hexString, answer)
+
+    return answer
+
+
+def uptimeLoop(byteData):
+    value = 0
+    for x, b in enumerate(byteData):
+        value += b * 256 ** x
+    log.debug("Uptime %s decoded to %s", byteData, value)
+    return value
+
+
+class Device:
+    name = 'bench'
+
+
+def frameFields():
+    '''
+    (record, name): memoryview of the string style fields of simulated cell data and info frames
+    '''
+    sim = SimulatedTransport(Device())
+    fields = {}
+    for record, mapping, frame in (('cell', getProtocol().cellInfoMapping, sim.cellFrame()), ('info', InfoResponseMapping, sim.infoFrame())):
+        view = memoryview(frame)
+        for name, _, _, converter, start, stop in RecordDecoder(mapping).steps:
+            if converter is not None:
+                fields[record, name] = view[start:stop]
+    return fields
+
+
+def main():
+    fields = frameFields()
+    info = memoryview(SimulatedTransport(Device()).infoFrame())
+    results = [
+        ('Hex2Str EnabledCellsBitmask', hex2StrLoop, Hex2Str, fields['cell', 'EnabledCellsBitmask']),
+        ('Hex2Str 16 bytes', hex2StrLoop, Hex2Str, info[6:22]),
+        ('Hex2Ascii DeviceModel', hex2AsciiLoop, Hex2Ascii, fields['info', 'DeviceModel']),
+        ('Hex2Ascii 100 bytes (info record)', hex2AsciiLoop, Hex2Ascii, info[6:106]),
+        ('uptime Uptime (cell record)', uptimeLoop, uptime, fields['cell', 'Uptime']),
+        ('uptime Uptime (info record)', uptimeLoop, uptime, fields['info', 'Uptime']),
+    ]
+    print('{:<36} {:>12} {:>12} {:>8}'.format('', 'loop us', 'bulk us', 'speedup'))
+    for name, old, new, value in results:
+        before = min(timeit.repeat(lambda: old(value), number=NUMBER, repeat=5)) / NUMBER
+        after = min(timeit.repeat(lambda: new(value), number=NUMBER, repeat=5)) / NUMBER
+        print('{:<36} {:12.3f} {:12.3f} {:7.1f}x'.format(name, before * 1e6, after * 1e6, before / after))
+
+
+if __name__ == '__main__':
+    main()
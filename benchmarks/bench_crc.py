@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the per-frame checksum cost
+
+Compares the former per-byte crc8 loop (re-run over the whole buffer on every
+notification once 300 bytes are buffered) with the sum() based crc8, and three
+FrameBuffer checksum strategies: whole frame sum() on every check, running sum
+updated in append() for every notification, and the running sum extended per
+frame length check that FrameBuffer uses.
+
+    python benchmarks/bench_crc.py
+"""
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from jkbms.framebuffer import SOR, FrameBuffer  # noqa: E402
+from jkbms.jkbmsdecode import crc8  # noqa: E402
+
+NOTIFICATION_SIZE = 20
+REPEAT = 2000
+RUNS = 7
+
+
+def crc8Loop(byteData):
+    CRC = 0
+    for b in byteData:
+        CRC = CRC + b
+        CRC &= 0xff
+    return CRC
+
+
+class WholeSumFrameBuffer(FrameBuffer):
+    '''
+    FrameBuffer as before the running checksum: whole frame sum() on every check
+    '''
+
+    def frameValid(self, length):
+        end = self.start + length
+        return crc8(self.view[self.start:end - 1]) == self.buffer[end - 1]
+
+
+class AppendSumFrameBuffer(FrameBuffer):
+    '''
+    Alternative with the running checksum updated in append() for every notification
+    '''
+
+    def append(self, data):
+        size = len(data)
+        if self.end + size > self.capacity:
+            self.compact()
+        self.view[self.end:self.end + size] = data
+        self.end += size
+        if self.synced:
+            stop = min(self.end, self.start + self.maxFrameLength - 1)
+            if stop > self.start + self.checksumLength:
+                self.checksum += sum(self.view[self.start + self.checksumLength:stop])
+                self.checksumLength = stop - self.start
+
+    def frameValid(self, length):
+        dataLength = length - 1
+        if dataLength > self.checksumLength:
+            self.checksum += sum(self.view[self.start + self.checksumLength:self.start + dataLength])
+            self.checksumLength = dataLength
+        checksum = self.checksum
+        if dataLength < self.checksumLength:
+            # Bytes summed past the frame (its checksum byte, the next frame)
+            checksum -= sum(self.view[self.start + dataLength:self.start + self.checksumLength])
+        return checksum & 0xff == self.buffer[self.start + dataLength]
+
+
+def makeFrame(length=300):
+    frame = bytearray(SOR + b'\x02' + os.urandom(length - 6))
+    return bytes(frame + bytes([crc8(frame)]))
+
+
+def framePerByteLoop(frame):
+    # Former reassembly: whole buffer re-summed on every notification from 300 bytes on
+    data = bytearray()
+    for i in range(0, len(frame), NOTIFICATION_SIZE):
+        data += frame[i:i + NOTIFICATION_SIZE]
+        if len(data) >= 300:
+            crc8Loop(data[:-1])
+
+
+def frameSum(frame):
+    data = bytearray()
+    for i in range(0, len(frame), NOTIFICATION_SIZE):
+        data += frame[i:i + NOTIFICATION_SIZE]
+        if len(data) >= 300:
+            crc8(memoryview(data)[:-1])
+
+
+def frameRunning(frame, frameBuffer):
+    for i in range(0, len(frame), NOTIFICATION_SIZE):
+        frameBuffer.append(frame[i:i + NOTIFICATION_SIZE])
+        frameBuffer.frame((2,))
+
+
+def main():
+    for length in (300, 320):
+        frame = makeFrame(length)
+        frameBuffer = FrameBuffer()
+        wholeSumBuffer = WholeSumFrameBuffer()
+        appendSumBuffer = AppendSumFrameBuffer()
+        results = [
+            ('crc8 per-byte loop, whole frame', lambda: crc8Loop(frame[:-1])),
+            ('crc8 sum(), whole frame', lambda: crc8(frame[:-1])),
+            ('reassembly + per-byte loop', lambda: framePerByteLoop(frame)),
+            ('reassembly + sum()', lambda: frameSum(frame)),
+            ('FrameBuffer, whole frame sum() per check', lambda: frameRunning(frame, wholeSumBuffer)),
+            ('FrameBuffer, running sum in append()', lambda: frameRunning(frame, appendSumBuffer)),
+            ('FrameBuffer, running sum per check', lambda: frameRunning(frame, frameBuffer)),
+        ]
+        print('Frame length {} bytes, {} byte notifications'.format(length, NOTIFICATION_SIZE))
+        for name, func in results:
+            seconds = min(timeit.repeat(func, number=REPEAT, repeat=RUNS)) / REPEAT
+            print('  {:<42} {:8.2f} us/frame'.format(name, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
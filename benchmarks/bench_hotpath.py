@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the decode, format and publish hot path
+
+Stages: crc8, Hex2Str/Hex2Ascii, DecodeFormat, RecordDecoder.decode (replaces
+the former per-field convertField), serializer formatting (topics, json, influx2),
+processCellDataRecord
+end to end and publishing to a local stand-in broker (needs paho-mqtt).
+Canned 300 byte cell and info records are built by the simulated BMS.
+
+    python benchmarks/bench_hotpath.py [--json results.json] [--compare baseline.json]
+"""
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+from argparse import ArgumentParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakebroker import FakeBroker  # noqa: E402
+from jkbms.jkbms import cellInfoDecoder, infoDecoder, jkBMS, jkBmsDelegate  # noqa: E402
+from jkbms.jkbmsdecode import DATA_UINT16, DecodeFormat, Hex2Ascii, Hex2Str, crc8  # noqa: E402
+from jkbms.publishMqtt import FORMATS, createSerializer  # noqa: E402
+from jkbms.version import __version__  # noqa: E402
+
+PUBLISH_FRAMES = 200
+
+
+class NullPublisher:
+    def __init__(self):
+        self.count = 0
+
+    def multiple(self, msgs):
+        self.count += len(msgs)
+
+
+def cannedDevice(publisher):
+    random.seed(0)
+    jk = jkBMS(name='bench', model=None, mac=None, command=None, tag='Bench', format=None, records=sys.maxsize, publisher=publisher, transport='sim')
+    delegate = jkBmsDelegate(jk)
+    cellFrame = jk.transport.cellFrame()
+    infoFrame = jk.transport.infoFrame()
+    return jk, delegate, cellFrame, infoFrame
+
+
+def measure(name, func, number, unit='call'):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    return {'name': name, 'unit': unit, 'us': round(seconds * 1e6, 3), 'per_s': round(1 / seconds, 1)}
+
+
+def benchDecode():
+    publisher = NullPublisher()
+    jk, delegate, cellFrame, infoFrame = cannedDevice(publisher)
+    fields = cellInfoDecoder.decode(cellFrame)
+    items = [(name, unit, fields[name]) for name, unit, _ in cellInfoDecoder.fields if name in fields]
+    serializers = [(format, createSerializer(format)) for format in FORMATS]
+    plans = [(format, serializer.plan('Bench', 'CellData', cellInfoDecoder.fields, cellInfoDecoder.types)) for format, serializer in serializers]
+    planned = [(entry, fields[entry[0]]) for entry in plans[0][1].tick(0) if entry[0] in fields]
+
+    return [
+        measure('crc8 (299 bytes)', lambda: crc8(cellFrame[:-1]), 10000),
+        measure('Hex2Str (4 bytes)', lambda: Hex2Str(cellFrame[70:74]), 100000),
+        measure('Hex2Ascii (16 bytes)', lambda: Hex2Ascii(infoFrame[6:22]), 100000),
+        measure('DecodeFormat (<H)', lambda: DecodeFormat(DATA_UINT16, cellFrame[6:8]), 100000),
+        measure('RecordDecoder.decode cell record', lambda: cellInfoDecoder.decode(cellFrame), 10000, 'record'),
+        measure('RecordDecoder.decode info record', lambda: infoDecoder.decode(infoFrame), 10000, 'record'),
+    ] + [
+        measure('serialize all cell fields ({})'.format(format), lambda serializer=serializer: serializer.serialize('Bench', 'CellData', items, 0), 2000, 'record')
+        for format, serializer in serializers
+    ] + [
+        measure('publish plan all cell fields ({})'.format(format), lambda plan=plan: plan.serialize(planned, 0), 2000, 'record')
+        for format, plan in plans
+    ] + [
+        measure('processCellDataRecord end to end', lambda: delegate.processCellDataRecord(cellFrame), 2000, 'record'),
+    ]
+
+
+def benchPublish():
+    try:
+        from jkbms.publishMqtt import MqttPublisher
+    except ImportError as e:
+        return [{'name': 'publish to stand-in broker', 'skipped': str(e)}]
+    broker = FakeBroker()
+    broker.start()
+    publisher = MqttPublisher('127.0.0.1', port=broker.port)
+    publisher.connect()
+    try:
+        deadline = time.monotonic() + 10
+        while not publisher.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        jk, delegate, cellFrame, _ = cannedDevice(publisher)
+        start = time.perf_counter()
+        for _ in range(PUBLISH_FRAMES):
+            delegate.processCellDataRecord(cellFrame)
+        sent = publisher.published
+        broker.waitFor(sent)
+        seconds = (time.perf_counter() - start) / PUBLISH_FRAMES
+    finally:
+        publisher.close()
+        broker.stop()
+    return [{
+        'name': 'processCellDataRecord + publish to stand-in broker',
+        'unit': 'record',
+        'us': round(seconds * 1e6, 3),
+        'per_s': round(1 / seconds, 1),
+        'messages': broker.count,
+    }]
+
+
+def compare(results, path):
+    with open(path) as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+    print('\nCompared to {}'.format(path))
+    for result in results:
+        old = baseline.get(result['name'])
+        if 'us' in result and old and 'us' in old:
+            print('  {:<52} {:+7.1f}%'.format(result['name'], (result['us'] / old['us'] - 1) * 100))
+
+
+def main():
+    parser = ArgumentParser(description='JKBMS hot path benchmarks')
+    parser.add_argument('--json', help='Write machine readable results to this file')
+    parser.add_argument('--compare', help='Compare with the results of an earlier --json run')
+    args = parser.parse_args()
+
+    results = benchDecode() + benchPublish()
+    for result in results:
+        if 'skipped' in result:
+            print('{:<54} skipped: {}'.format(result['name'], result['skipped']))
+        else:
+            print('{:<54} {:10.2f} us/{:<7} {:12.1f}/s'.format(result['name'], result['us'], result['unit'], result['per_s']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'version': __version__,
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'timestamp': int(time.time()),
+                'results': results,
+            }, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Startup time budget of the jkbms CLI modes
+
+Every mode runs in a fresh interpreter (like cron one-shot runs do), the median
+wall time of --runs runs is checked against the budget of the mode. Modes that
+do not talk to a BMS must not import the BLE, systemd, MQTT or storage modules.
+Exits with 1 when a budget is exceeded or a forbidden module was imported.
+Budgets are for a desktop class machine, scale them for small boards:
+
+    python benchmarks/bench_startup.py [--runs 7] [--scale 5] [--json results.json]
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules only the device modes may load
+HEAVY_MODULES = ('bluepy', 'bleak', 'systemd', 'paho', 'sqlite3', 'http.server', 'asyncio', 'serial')
+
+# Runs main() with argv and reports the loaded heavy modules on stderr
+RUNNER = '''
+import sys
+sys.argv = ['jkbms'] + {argv!r}
+import jkbms
+try:
+    jkbms.main()
+except SystemExit:
+    pass
+loaded = [name for name in {heavy!r} if name in sys.modules]
+print('LOADED ' + ','.join(loaded), file=sys.stderr)
+'''
+
+CONFIG = '''[SETUP]
+records = 1
+[Power Wall 1]
+model = JK-B2A24S
+mac = 3c:a5:09:0a:85:79
+command = command
+tag = Power_Wall_1
+'''
+
+
+def sampleFrame():
+    sys.path.insert(0, ROOT)
+    from jkbms.transport import SimulatedTransport
+
+    class Device:
+        name = 'bench'
+    return SimulatedTransport(Device()).cellFrame().hex()
+
+
+def modes(directory):
+    config = os.path.join(directory, 'jkbms.conf')
+    with open(config, 'w') as f:
+        f.write(CONFIG)
+    frame = sampleFrame()
+    capture = os.path.join(directory, 'capture.txt')
+    with open(capture, 'w') as f:
+        f.write('\n'.join(frame[i:i + 256] for i in range(0, len(frame), 256)) * 20)
+    # (name, argv, budget ms)
+    return [
+        ('import jkbms', None, 150),
+        ('help (-h)', ['-h'], 150),
+        ('dump config (-d)', ['-c', config, '-d'], 150),
+        ('decode hex (-x)', ['-x', frame], 200),
+        ('replay 20 frames (-R)', ['-R', capture, '-o', os.devnull], 250),
+    ]
+
+
+def run(argv):
+    if argv is None:
+        code = 'import sys, jkbms; print("LOADED " + ",".join(n for n in {!r} if n in sys.modules), file=sys.stderr)'.format(HEAVY_MODULES)
+    else:
+        code = RUNNER.format(argv=argv, heavy=HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - start
+    loaded = []
+    for line in result.stderr.splitlines():
+        if line.startswith('LOADED '):
+            loaded = [name for name in line[7:].split(',') if name]
+    if result.returncode != 0 or not any(line.startswith('LOADED') for line in result.stderr.splitlines()):
+        raise RuntimeError('{} failed:\n{}'.format(argv, result.stderr))
+    return seconds, loaded
+
+
+def bare():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description='JKBMS CLI startup budgets')
+    parser.add_argument('--runs', type=int, default=7, help='Runs per mode, the median is checked')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply every budget (e.g. 5 for a Raspberry Pi Zero)')
+    parser.add_argument('--json', help='Write machine readable results to this file')
+    args = parser.parse_args()
+
+    # Interpreter startup without jkbms, for reference
+    baseline = statistics.median([bare() for _ in range(args.runs)])
+    print('{:<28} {:8.1f} ms'.format('python (no imports)', baseline * 1000))
+    results = []
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        for name, argv, budget in modes(directory):
+            timings = []
+            loaded = []
+            for _ in range(args.runs):
+                seconds, loaded = run(argv)
+                timings.append(seconds)
+            ms = statistics.median(timings) * 1000
+            budget *= args.scale
+            ok = ms <= budget and not loaded
+            failed = failed or not ok
+            print('{:<28} {:8.1f} ms  budget {:6.0f} ms  {}{}'.format(name, ms, budget, 'ok' if ok else 'OVER BUDGET' if ms > budget else 'FAILED', '  loaded: ' + ', '.join(loaded) if loaded else ''))
+            results.append({'name': name, 'ms': round(ms, 1), 'budget_ms': budget, 'loaded': loaded, 'ok': ok})
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'timestamp': int(time.time()),
+                'baseline_ms': round(baseline * 1000, 1),
+                'results': results,
+            }, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
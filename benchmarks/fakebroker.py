@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Minimal stand-in MQTT broker for benchmarks
+
+Accepts MQTT 3.1.1 clients, acknowledges CONNECT, PUBLISH (QoS 1/2) and
+PINGREQ and counts the received PUBLISH packets. Nothing is routed or stored.
+"""
+import socket
+import socketserver
+import threading
+
+CONNECT = 0x10
+PUBLISH = 0x30
+PUBREL = 0x60
+PINGREQ = 0xC0
+DISCONNECT = 0xE0
+
+
+class BrokerHandler(socketserver.BaseRequestHandler):
+
+    def readExactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                header = self.readExactly(1)[0]
+                length = 0
+                multiplier = 1
+                while True:
+                    byte = self.readExactly(1)[0]
+                    length += (byte & 0x7f) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = self.readExactly(length)
+                packetType = header & 0xf0
+                if packetType == CONNECT:
+                    self.request.sendall(b'\x20\x02\x00\x00')
+                elif packetType == PUBLISH:
+                    qos = (header >> 1) & 0x03
+                    if qos:
+                        topicLength = int.from_bytes(body[0:2], 'big')
+                        packetId = body[2 + topicLength:4 + topicLength]
+                        self.request.sendall((b'\x40\x02' if qos == 1 else b'\x50\x02') + packetId)
+                    self.server.received()
+                elif packetType == PUBREL:
+                    self.request.sendall(b'\x70\x02' + body[0:2])
+                elif packetType == PINGREQ:
+                    self.request.sendall(b'\xd0\x00')
+                elif packetType == DISCONNECT:
+                    return
+        except (ConnectionError, OSError):
+            return
+
+
+class FakeBroker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), BrokerHandler)
+        self.lock = threading.Condition()
+        self.count = 0
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def received(self):
+        with self.lock:
+            self.count += 1
+            self.lock.notify_all()
+
+    def waitFor(self, count, timeout=30):
+        with self.lock:
+            return self.lock.wait_for(lambda: self.count >= count, timeout)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
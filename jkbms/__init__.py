@@ -7,6 +7,14 @@ from argparse import ArgumentParser
 
 from .version import __version__  # noqa: F401
 from .jkbms import jkBMS
+from .metrics import MetricsServer
+from .filters import parseThresholds
+from .publishMqtt import MqttPublisher, StreamPublisher
+from .replay import CAPTURE_FORMATS, decodeHex, replay
+from .supervisor import Supervisor, Watchdog
+from .transport import Backoff
+from .trace import installDumpHandler
+from .cache import HandleCache, InfoCache
 
 # import mppcommands
 # from .mpputils import mppUtils
@@ -52,6 +60,22 @@ def main(daemon=False):
     parser.add_argument(
         "-x", "--decodeHex", help="Hex to decode (will not communicate to BMS)"
     )
+    parser.add_argument(
+        "-R",
+        "--replay",
+        nargs="+",
+        metavar="CAPTURE",
+        help="Decode captured BLE notifications from file(s) at full speed (will not communicate to BMS)",
+    )
+    parser.add_argument(
+        "--replayFormat",
+        choices=CAPTURE_FORMATS,
+        default="auto",
+        help="Format of the replay capture files (default: auto detect)",
+    )
+    parser.add_argument(
+        "-o", "--output", help="Write replay results to this file instead of stdout"
+    )
     parser.add_argument(
         "-d",
         "--dumpConfigFile",
@@ -72,9 +96,16 @@ def main(daemon=False):
     )
     args = parser.parse_args()
 
+    if args.enableDebug:
+        log.setLevel(logging.DEBUG)
+    elif args.enableInfo:
+        log.setLevel(logging.INFO)
+
     if args.decodeHex:
         print("Decode Hex {}".format(args.decodeHex))
         print("Hex: {} decoded to {}".format(args.decodeHex, decodeHex(args.decodeHex)))
+    elif args.replay:
+        replay(args.replay, format=args.replayFormat, output=args.output, tag=args.name or "Replay")
     else:
         print("Query BMS via BLE")
         log.info("Getting {} records".format(args.records))
@@ -90,8 +121,46 @@ def main(daemon=False):
             sections = config.sections()
             if "SETUP" in config:
                 mqtt_broker = config["SETUP"].get("mqtt_broker", fallback=None)
+                mqtt_port = config["SETUP"].getint("mqtt_port", fallback=1883)
+                mqtt_qos = config["SETUP"].getint("mqtt_qos", fallback=0)
+                mqtt_keepalive = config["SETUP"].getint("mqtt_keepalive", fallback=60)
+                mqtt_reconnect_max = config["SETUP"].getint("mqtt_reconnect_max", fallback=120)
+                mqtt_connect_timeout = config["SETUP"].getfloat("mqtt_connect_timeout", fallback=10)
+                mqtt_max_queued = config["SETUP"].getint("mqtt_max_queued", fallback=1000)
                 records = config["SETUP"].getint("records", fallback=1)
                 recordDivider = config["SETUP"].getint("record_divider", fallback=1)
+                queue_size = config["SETUP"].getint("queue_size", fallback=16)
+                queue_policy = config["SETUP"].get("queue_policy", fallback="drop-oldest")
+                ble_backend = config["SETUP"].get("ble_backend", fallback="bluepy")
+                gatt_cache = config["SETUP"].get("gatt_cache", fallback="~/.cache/jkbms/gatt.json")
+                info_cache = config["SETUP"].get("info_cache", fallback="~/.cache/jkbms/info.json")
+                reconnect_delay_min = config["SETUP"].getfloat("reconnect_delay_min", fallback=0.5)
+                reconnect_delay_max = config["SETUP"].getfloat("reconnect_delay_max", fallback=30.0)
+                metrics_port = config["SETUP"].getint("metrics_port", fallback=0)
+                metrics_address = config["SETUP"].get("metrics_address", fallback="")
+                trace_size = config["SETUP"].getint("trace_size", fallback=0)
+                command_timeout = config["SETUP"].getfloat("command_timeout", fallback=5.0)
+                info_interval = config["SETUP"].getint("info_interval", fallback=3600)
+                trace_sample = config["SETUP"].getint("trace_sample", fallback=1)
+                deadband = config["SETUP"].get("deadband", fallback=None)
+                if deadband is not None:
+                    deadband = parseThresholds(deadband)
+                deadband_max_age = config["SETUP"].getfloat("deadband_max_age", fallback=300)
+                aggregate_window = config["SETUP"].getfloat("aggregate_window", fallback=0)
+                spool_dir = config["SETUP"].get("spool_dir", fallback=None)
+                spool_segment_size = config["SETUP"].getint("spool_segment_size", fallback=1 << 20)
+                spool_max_size = config["SETUP"].getint("spool_max_size", fallback=64 << 20)
+                spool_max_age = config["SETUP"].getint("spool_max_age", fallback=7 * 24 * 3600)
+                spool_drain_rate = config["SETUP"].getint("spool_drain_rate", fallback=500)
+                sqlite_db = config["SETUP"].get("sqlite_db", fallback=None)
+                sqlite_batch_size = config["SETUP"].getint("sqlite_batch_size", fallback=60)
+                sqlite_flush_interval = config["SETUP"].getint("sqlite_flush_interval", fallback=10)
+                sqlite_retention_days = config["SETUP"].getint("sqlite_retention_days", fallback=30)
+                hci_adapters = [
+                    int(adapter)
+                    for adapter in config["SETUP"].get("hci_adapters", fallback="").split(",")
+                    if adapter.strip()
+                ]
                 logging_level = config["SETUP"].getint(
                     "logging_level", fallback=logging.CRITICAL
                 )
@@ -127,14 +196,78 @@ def main(daemon=False):
             else:
                 print("Section called {} not found. Exiting".format(args.name))
                 sys.exit(1)
-        # Process each section
-        for section in sections:
+        publisher = None
+        if args.printResultsOnly:
+            publisher = StreamPublisher(sys.stdout)
+        elif mqtt_broker:
+            publisher = MqttPublisher(
+                mqtt_broker,
+                port=mqtt_port,
+                qos=mqtt_qos,
+                keepalive=mqtt_keepalive,
+                maxReconnectDelay=mqtt_reconnect_max,
+                connectTimeout=mqtt_connect_timeout,
+                maxQueued=mqtt_max_queued,
+            )
+            if spool_dir:
+                from .spool import Spool, SpoolingPublisher
+
+                spool = Spool(
+                    spool_dir,
+                    segmentSize=spool_segment_size,
+                    maxBytes=spool_max_size,
+                    maxAge=spool_max_age,
+                )
+                publisher = SpoolingPublisher(publisher, spool, drainRate=spool_drain_rate)
+            log.debug(str(publisher))
+            publisher.connect()
+        sinks = []
+        if sqlite_db:
+            from .sqlitesink import SqliteSink
+
+            sinks.append(
+                SqliteSink(
+                    sqlite_db,
+                    batchSize=sqlite_batch_size,
+                    flushInterval=sqlite_flush_interval,
+                    retentionDays=sqlite_retention_days,
+                )
+            )
+        handle_cache = HandleCache(gatt_cache) if gatt_cache else None
+        info_cache = InfoCache(info_cache) if info_cache else None
+        # Process each section, every device runs concurrently in its own thread
+        devices = []
+        for index, section in enumerate(sections):
             name = section
             model = config[section].get("model")
             mac = config[section].get("mac")
             command = config[section].get("command")
             tag = config[section].get("tag")
             format = config[section].get("format")
+            adapter = config[section].getint("adapter", fallback=None)
+            transport = config[section].get("transport", fallback="ble")
+            protocol = config[section].get("protocol", fallback="auto")
+            transport_options = {}
+            if transport == "ble":
+                transport_options = {
+                    "handleCache": handle_cache,
+                    "minDelay": reconnect_delay_min,
+                    "maxDelay": reconnect_delay_max,
+                }
+            elif transport == "serial":
+                transport_options = {
+                    "port": config[section].get("port", fallback="/dev/ttyUSB0"),
+                    "baudrate": config[section].getint("baudrate", fallback=115200),
+                }
+            elif transport == "sim":
+                transport_options = {
+                    "rate": config[section].getfloat("sim_rate", fallback=1.0),
+                    "cells": config[section].getint("sim_cells", fallback=16),
+                    "firmware": config[section].get("sim_firmware", fallback="11.26"),
+                }
+            if adapter is None and hci_adapters:
+                # Spread devices without an explicit adapter over the available ones
+                adapter = hci_adapters[index % len(hci_adapters)]
             jk = jkBMS(
                 name=name,
                 model=model,
@@ -146,11 +279,57 @@ def main(daemon=False):
                 recordDivider=recordDivider,
                 maxConnectionAttempts=max_connection_attempts,
                 mqttBroker=mqtt_broker,
-                daemon=daemon
+                daemon=daemon,
+                publisher=publisher,
+                queueSize=queue_size,
+                queuePolicy=queue_policy,
+                adapter=adapter,
+                transport=transport,
+                transportOptions=transport_options,
+                deadband=deadband,
+                deadbandMaxAge=deadband_max_age,
+                sinks=sinks,
+                aggregateWindow=aggregate_window,
+                traceSize=trace_size,
+                traceSample=trace_sample,
+                protocol=protocol,
+                commandTimeout=command_timeout,
+                infoInterval=info_interval,
+                infoCache=info_cache,
             )
             log.debug(str(jk))
-            if jk.connect():
-                jk.getBLEData()
-                jk.disconnect()
-            else:
-                print("Failed to connect to {} {}".format(name, mac))
+            devices.append(jk)
+        if trace_size:
+            installDumpHandler(devices)
+        metrics = None
+        if metrics_port:
+            metrics = MetricsServer(devices, port=metrics_port, address=metrics_address)
+            metrics.start()
+        asyncDevices = []
+        if ble_backend == "bleak":
+            # BLE devices share one asyncio event loop, other transports keep their threads
+            asyncDevices = [jk for jk in devices if jk.transportName == "ble"]
+            devices = [jk for jk in devices if jk.transportName != "ble"]
+        backoff = Backoff(reconnect_delay_min, reconnect_delay_max)
+        supervisor = Supervisor(devices, daemon=daemon, backoff=backoff)
+        supervisor.start()
+        watchdog = None
+        if daemon:
+            watchdog = Watchdog(devices + asyncDevices, threads=supervisor.threads)
+            watchdog.start()
+        try:
+            if asyncDevices:
+                from .asyncble import AsyncSupervisor
+
+                AsyncSupervisor(asyncDevices, daemon=daemon, backoff=backoff).run()
+            supervisor.join()
+        except KeyboardInterrupt:
+            supervisor.stop()
+        if watchdog:
+            watchdog.stop()
+        if metrics:
+            metrics.stop()
+        if publisher:
+            publisher.close()
+        for sink in sinks:
+            sink.close()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import time
+
+from bleak import BleakClient
+from bleak.exc import BleakError
+
+from .jkbms import jkBmsDelegate
+from .scheduler import CommandScheduler
+from .transport import Backoff
+
+log = logging.getLogger('JKBMS-BT')
+
+CHARACTERISTIC_NOTIFY = '0000ffe1-0000-1000-8000-00805f9b34fb'
+
+
+class AsyncBleClient:
+    '''
+    asyncio BLE client for one JKBMS using bleak
+    - connect, subscribe and requests are awaited, no fixed sleeps
+    - notifications only feed the frame buffer on the event loop, records are processed by the delegate's worker
+    - the commands are sent by the same CommandScheduler as on the bluepy backend, stepped on the event loop
+    - failed connection attempts are retried with exponential backoff
+    '''
+
+    def __init__(self, jkbms, connectTimeout=20.0, backoff=None):
+        self.jkbms = jkbms
+        self.connectTimeout = connectTimeout
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.client = None
+        self.delegate = None
+        self.loop = None
+        self.disconnected = None
+        self.notified = None
+
+    def onDisconnect(self, client):
+        log.warning('{} disconnected'.format(self.jkbms.name))
+        self.disconnected.set()
+
+    def onNotification(self, sender, data):
+        self.delegate.handleNotification(0, data)
+        # Wakes up the scheduler, which checks the frames received per record type
+        self.notified.set()
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        self.disconnected = asyncio.Event()
+        self.notified = asyncio.Event()
+        self.delegate = jkBmsDelegate(self.jkbms)
+        self.jkbms.delegate = self.delegate
+        options = {}
+        if self.jkbms.adapter is not None:
+            options['adapter'] = 'hci{}'.format(self.jkbms.adapter)
+        self.client = BleakClient(self.jkbms.mac, disconnected_callback=self.onDisconnect, timeout=self.connectTimeout, **options)
+        log.info('Attempting to connect to {}'.format(self.jkbms.name))
+        for attempt in range(1, self.jkbms.maxConnectionAttempts + 1):
+            if attempt > 1:
+                delay = self.backoff.delay(attempt - 2)
+                log.info('Retrying {} in {:.1f}s'.format(self.jkbms.name, delay))
+                await asyncio.sleep(delay)
+            try:
+                await self.client.connect()
+                return True
+            except (BleakError, asyncio.TimeoutError, OSError) as e:
+                log.info('Connection attempt {} to {} failed: {}'.format(attempt, self.jkbms.name, e))
+        log.warning('Cannot connect to {} with mac {} - exceeded {} attempts'.format(self.jkbms.name, self.jkbms.mac, self.jkbms.maxConnectionAttempts))
+        return False
+
+    async def getData(self):
+        self.delegate.worker.start()
+        try:
+            await self.client.start_notify(CHARACTERISTIC_NOTIFY, self.onNotification)
+            scheduler = self.jkbms.scheduler = CommandScheduler(self, self.delegate, self.jkbms.commands())
+            scheduler.start()
+            while not self.disconnected.is_set():
+                self.notified.clear()
+                command, timeout = scheduler.step(time.monotonic(), onReady=self.jkbms.ready)
+                if command is not None:
+                    await self.client.write_gatt_char(CHARACTERISTIC_NOTIFY, command.payload, response=False)
+                    log.info('Write {} (attempt {})'.format(command.name, scheduler.attempt + 1))
+                if scheduler.ready and self.jkbms.sessionDone():
+                    break
+                try:
+                    await asyncio.wait_for(self.notified.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Joining the worker blocks, keep the event loop free for the other devices
+            await self.loop.run_in_executor(None, self.delegate.worker.stop)
+
+    async def disconnect(self):
+        log.info('Disconnecting...')
+        if self.client is not None and self.client.is_connected:
+            await self.client.disconnect()
+
+
+class AsyncSupervisor:
+    '''
+    Runs the BLE sessions of many JKBMS devices on one asyncio event loop
+    - in daemon mode each device reconnects independently as soon as its link is lost, with the
+      same backoff as the threaded Supervisor
+    - a session whose link was lost before any record counts as failed (no tight reconnect loop)
+    '''
+
+    def __init__(self, devices, daemon=False, backoff=None):
+        self.devices = devices
+        self.isDaemon = daemon
+        self.backoff = backoff if backoff is not None else Backoff()
+
+    async def runDevice(self, jk):
+        sessions = 0
+        retries = 0
+        while True:
+            sessions += 1
+            client = AsyncBleClient(jk, backoff=self.backoff)
+            failed = False
+            try:
+                if await client.connect():
+                    try:
+                        await client.getData()
+                    finally:
+                        await client.disconnect()
+                    if client.disconnected.is_set() and not client.delegate.record_counter:
+                        failed = True
+                        log.warning('{} disconnected before any record'.format(jk.name))
+                else:
+                    failed = True
+                    log.warning('Failed to connect to {} {}'.format(jk.name, jk.mac))
+            except Exception:
+                failed = True
+                log.exception('Session {} of {} failed'.format(sessions, jk.name))
+            if not self.isDaemon:
+                return
+            if client.delegate is not None and client.delegate.record_counter:
+                retries = 0
+            if failed:
+                delay = self.backoff.delay(retries)
+                retries += 1
+                log.info('Restarting {} in {:.1f}s'.format(jk.name, delay))
+                await asyncio.sleep(delay)
+
+    async def runAll(self):
+        await asyncio.gather(*(self.runDevice(jk) for jk in self.devices))
+
+    def run(self):
+        asyncio.run(self.runAll())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger('JKBMS-BT')
+
+
+class MacCache:
+    '''
+    Per MAC entries persisted as one JSON file, shared by all devices (thread safe)
+    - the file is rewritten (write and rename) whenever an entry changes
+    '''
+    description = 'cache'
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            log.warning('Ignoring {} {}: {}'.format(self.description, self.path, e))
+
+    def get(self, mac):
+        with self.lock:
+            return self.entries.get(mac.lower())
+
+    def set(self, mac, entry):
+        with self.lock:
+            self.entries[mac.lower()] = entry
+            self.save()
+
+    def invalidate(self, mac):
+        with self.lock:
+            if self.entries.pop(mac.lower(), None) is not None:
+                self.save()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Write and rename so a crash never leaves a truncated cache
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning('Cannot write {} {}: {}'.format(self.description, self.path, e))
+
+
+class HandleCache(MacCache):
+    '''
+    GATT handles per MAC, so reconnects can skip service discovery
+    - {mac: {"read": handle, "notify": handle}}
+    '''
+    description = 'GATT handle cache'
+
+    def put(self, mac, read, notify):
+        self.set(mac, {'read': read, 'notify': notify})
+
+
+class InfoCache(MacCache):
+    '''
+    Device identity (model, firmware, serial number, ...) per MAC from the last info record
+    - {mac: {"checksum": crc32 of the identity bytes, "fields": {name: value}}}
+    - lets a device skip decoding an unchanged identity and select its layout, also across restarts
+    '''
+    description = 'info record cache'
+
+    def put(self, mac, checksum, fields):
+        self.set(mac, {'checksum': checksum, 'fields': fields})
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+import logging
+
+log = logging.getLogger('JKBMS-BT')
+
+
+def parseThresholds(text):
+    '''
+    Parse 'V:0.005, A:0.1, C:0.5' into {'V': 0.005, 'A': 0.1, 'C': 0.5}
+    '''
+    thresholds = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        unit, _, threshold = item.partition(':')
+        thresholds[unit.strip()] = float(threshold)
+    return thresholds
+
+
+class Deadband:
+    '''
+    Change-only (deadband) filter for published fields
+    - numeric fields pass when they moved by more than the threshold of their unit since last published
+    - units without a threshold and string fields pass on any change
+    - every field passes again after maxAge seconds without publishing (heartbeat)
+    '''
+
+    def __init__(self, thresholds, maxAge=300):
+        self.thresholds = thresholds
+        self.maxAge = maxAge
+        # name: (last published value, time published)
+        self.last = {}
+        self.passed = 0
+        self.suppressed = 0
+
+    def publish(self, name, unit, value, now):
+        '''
+        Return True when value should be published, remembers it as published
+        '''
+        last = self.last.get(name)
+        if last is not None and now - last[1] < self.maxAge:
+            lastValue = last[0]
+            if type(value) is str or type(lastValue) is str:
+                changed = value != lastValue
+            else:
+                changed = abs(value - lastValue) > self.thresholds.get(unit, 0)
+            if not changed:
+                self.suppressed += 1
+                return False
+        self.last[name] = (value, now)
+        self.passed += 1
+        return True
+
+
+class Aggregator:
+    '''
+    Rolling min/mean/max/last aggregation of every record over a window of seconds
+    - constant memory: one accumulator per field
+    - add() returns the summary of the window once it is complete, otherwise None
+    - summary: <name> (last value), <name>Min, <name>Max, <name>Mean for numeric fields, <name> (last) for strings
+    - a field with an EVERYnTH frequency is summarized every n-th window, it keeps accumulating over
+      the windows in between so their extremes are not lost
+    '''
+    suffixes = ('Min', 'Max', 'Mean')
+
+    def __init__(self, window, frequencies=None):
+        self.window = window
+        # name: summarized every n-th window (default: every window)
+        self.frequencies = frequencies or {}
+        self.windowStart = None
+        self.windows = 0
+        # name: [min, max, sum, count, last]
+        self.accumulators = {}
+
+    @classmethod
+    def summaryFields(cls, fields, types):
+        '''
+        Expand a list of (name, unit, frequency) to the fields of a summary
+        - every summary field is published when present, the frequency is applied per window by summary()
+        '''
+        summary = []
+        for name, unit, frequency in fields:
+            summary.append((name, unit, 1))
+            if types.get(name) is not str:
+                summary.extend((name + suffix, unit, 1) for suffix in cls.suffixes)
+        return summary
+
+    def add(self, fields, now):
+        if self.windowStart is None:
+            self.windowStart = now
+        accumulators = self.accumulators
+        for name, value in fields.items():
+            accumulator = accumulators.get(name)
+            if type(value) is str:
+                accumulators[name] = value
+            elif accumulator is None:
+                accumulators[name] = [value, value, value, 1, value]
+            else:
+                if value < accumulator[0]:
+                    accumulator[0] = value
+                if value > accumulator[1]:
+                    accumulator[1] = value
+                accumulator[2] += value
+                accumulator[3] += 1
+                accumulator[4] = value
+        if now - self.windowStart < self.window:
+            return None
+        return self.summary(now)
+
+    def summary(self, now):
+        '''
+        Summary of the fields due in this window, their accumulators start over
+        '''
+        summary = {}
+        accumulators = self.accumulators
+        self.accumulators = {}
+        for name, accumulator in accumulators.items():
+            if self.windows % self.frequencies.get(name, 1):
+                # Not due yet, keep accumulating into the next window
+                self.accumulators[name] = accumulator
+            elif type(accumulator) is str:
+                summary[name] = accumulator
+            else:
+                low, high, total, count, last = accumulator
+                summary[name] = last
+                summary[name + 'Min'] = low
+                summary[name + 'Max'] = high
+                summary[name + 'Mean'] = total / count
+        self.windows += 1
+        self.windowStart = now
+        return summary
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import logging
+
+from .jkbmsdecode import crc8
+
+log = logging.getLogger('JKBMS-BT')
+
+# Start of record
+SOR = bytes.fromhex("55aaeb90")
+RECORD_TYPE_OFFSET = 4
+# Record lengths (including the trailing checksum byte) the JKBMS sends
+FRAME_LENGTHS = (300, 320)
+SHORT_FRAME_LENGTH = 100
+
+
+class FrameBuffer:
+    '''
+    Fixed capacity reassembly buffer for BLE notifications
+    - notifications are copied into a preallocated bytearray, nothing is allocated per notification
+    - the SOR search continues from the last scanned position
+    - the frame checksum is a running sum, every byte is added only once per frame candidate
+    - the sum is extended when a frame length is checked, not in append(): one C level sum() over
+      the new bytes per check is cheaper than a Python level update per 20 byte notification, and
+      no slower than summing the whole frame per check (benchmarks/bench_crc.py)
+    - complete frames are returned as memoryview into the buffer, valid until the next append()
+    '''
+
+    def __init__(self, capacity=1024, maxFrameLength=max(FRAME_LENGTHS)):
+        self.capacity = capacity
+        self.maxFrameLength = maxFrameLength
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        # start of the frame candidate (when synced) or of the unscanned data
+        self.start = 0
+        # end of the buffered data
+        self.end = 0
+        # SOR search continues from here
+        self.scan = 0
+        self.synced = False
+        # running checksum over the first checksumLength bytes of the frame candidate
+        self.checksum = 0
+        self.checksumLength = 0
+        self.resyncs = 0
+        self.checksumFailures = 0
+        self.overflows = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def clear(self):
+        self.start = self.end = self.scan = 0
+        self.synced = False
+        self.checksum = self.checksumLength = 0
+
+    def append(self, data):
+        size = len(data)
+        if self.end + size > self.capacity:
+            self.compact()
+            if self.end + size > self.capacity:
+                # Nothing useful can be kept, start over with the new data
+                self.overflows += 1
+                self.clear()
+                if size > self.capacity:
+                    data = data[-self.capacity:]
+                    size = self.capacity
+        self.view[self.end:self.end + size] = data
+        self.end += size
+
+    def compact(self):
+        '''
+        Move the buffered data to the start of the buffer (memmove, no allocation)
+        '''
+        if self.start == 0:
+            return
+        length = self.end - self.start
+        self.view[0:length] = self.view[self.start:self.end]
+        self.scan -= self.start
+        self.start = 0
+        self.end = length
+
+    def resync(self):
+        '''
+        Drop the current frame candidate and look for the next SOR after it
+        '''
+        self.resyncs += 1
+        self.synced = False
+        self.checksum = self.checksumLength = 0
+        self.scan = self.start + 1
+        self.start = self.scan
+
+    def frameValid(self, length):
+        '''
+        Check the trailing checksum byte of a frame of length bytes
+        - extends the running checksum only by the bytes not summed yet
+        - lengths of a frame candidate are checked in increasing order (100 only while exactly 100
+          bytes are buffered, then 300 and 320), the sum never has to shrink
+        '''
+        dataLength = length - 1
+        if dataLength > self.checksumLength:
+            self.checksum = (self.checksum + crc8(self.view[self.start + self.checksumLength:self.start + dataLength])) & 0xff
+            self.checksumLength = dataLength
+        return self.checksum == self.buffer[self.start + dataLength]
+
+    def frame(self, recordTypes=None):
+        '''
+        Return the next complete frame (memoryview) or None
+        - frames of other record types than recordTypes (a collection, None accepts all) are skipped
+        '''
+        while True:
+            if not self.synced:
+                pos = self.buffer.find(SOR, self.scan, self.end)
+                if pos == -1:
+                    # Keep the tail that could hold the start of a SOR
+                    self.scan = max(self.scan, self.end - len(SOR) + 1)
+                    self.start = self.scan
+                    return None
+                self.start = pos
+                self.synced = True
+            length = self.end - self.start
+            if length <= RECORD_TYPE_OFFSET:
+                return None
+            if recordTypes is not None and self.buffer[self.start + RECORD_TYPE_OFFSET] not in recordTypes:
+                log.debug('Not expected type of record - skipping')
+                self.resync()
+                continue
+            if length < FRAME_LENGTHS[0] and length != SHORT_FRAME_LENGTH:
+                return None
+            for frameLength in FRAME_LENGTHS:
+                if length >= frameLength and self.frameValid(frameLength):
+                    return self.take(frameLength)
+            if length == SHORT_FRAME_LENGTH and self.frameValid(length):
+                return self.take(length)
+            if length >= self.maxFrameLength:
+                log.debug('No valid record found - looking for next SOR')
+                self.checksumFailures += 1
+                self.resync()
+                continue
+            return None
+
+    def take(self, length):
+        frame = self.view[self.start:self.start + length]
+        self.start += length
+        self.scan = self.start
+        self.synced = False
+        self.checksum = self.checksumLength = 0
+        if self.start == self.end:
+            # Frame consumed all data, next append starts at the beginning again
+            self.start = self.end = self.scan = 0
+        return frame
@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
-from bluepy import btle
 import logging
-import systemd.daemon
 import time
 
-from .jkbms_mapping import CellInfoResponseMapping, InfoResponseMapping
-from .publishMqtt import publishMqtt as publish
-import paho.mqtt.publish as publishToMqtt
+from .publishMqtt import createSerializer, formatValue
 
-from .jkbmsdecode import DATA_ASCII, DecodeFormat, Hex2Ascii, crc8, Hex2Str, uptime
+from .filters import Aggregator, Deadband
+from .framebuffer import RECORD_TYPE_OFFSET, FrameBuffer
+from .jkbms_mapping import InfoIdentityFields
+from .metrics import DeviceMetrics
+from .trace import FrameTrace
+from .protocol import AUTO, getProtocol, selectProtocol
+from .scheduler import Command, CommandScheduler
+from .pipeline import DROP_OLDEST, RecordWorker
+from .transport import BLE, createTransport
 
 class hexdump:
     def __init__(self, buf, off=0):
@@ -49,152 +53,183 @@ getCellInfo = b'\xaa\x55\x90\xeb\x96\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00
 
 log = logging.getLogger('JKBMS-BT')
 
-SOR = bytes.fromhex("55aaeb90")
+# Decoders of the default layout, the decoders of every layout are compiled once in protocol
+cellInfoDecoder = getProtocol().cellInfoDecoder
+infoDecoder = getProtocol().infoDecoder
 
-class jkBmsDelegate(btle.DefaultDelegate):
+def systemdNotify(state):
+    '''
+    Send state to systemd, the systemd module is only imported in daemon mode
+    '''
+    import systemd.daemon
+
+    systemd.daemon.notify(state)
+
+
+class jkBmsDelegate:
     '''
     BLE delegate to deal with notifications (information) from the JKBMS device
     '''
     # JKBMS hat bei getCellInfo 0x02 und bei getInfo 0x03
     def __init__(self, jkbms):
-        btle.DefaultDelegate.__init__(self)
-        # extra initialisation here
+        # Notification callback object for every transport (bluepy only needs handleNotification)
         self.jkbms = jkbms
-        print('Delegate {}'.format(str(jkbms)))
-        self.notificationData = bytearray()
-        self.record_type = None
+        # Level checks are done once per session, not per notification / record
+        self.logInfo = log.isEnabledFor(logging.INFO)
+        self.logDebug = log.isEnabledFor(logging.DEBUG)
+        if self.logDebug:
+            log.debug('Delegate {}'.format(str(jkbms)))
+        self.trace = jkbms.trace
+        self.frames = FrameBuffer()
+        # Record types accepted by the frame reassembly (None: all), the command scheduler
+        # narrows it to the answers of the commands it sent
+        self.record_types = None
+        # Frames reassembled per record type, the command scheduler waits for these
+        self.received = [0] * 256
         self.record_counter = 0
         self.rx_counter = 0
+        # Last published values for change-only publishing
+        self.deadband = Deadband(jkbms.deadband, jkbms.deadbandMaxAge) if jkbms.deadband is not None else None
+        # Rolling min/mean/max/last summaries instead of sampled records
+        self.aggregator = Aggregator(jkbms.aggregateWindow) if jkbms.aggregateWindow else None
+        self.setProtocol(jkbms.protocol)
+        self.worker = RecordWorker(self.processRecord, maxsize=jkbms.queueSize, policy=jkbms.queuePolicy, name='jkbms-{}-worker'.format(jkbms.name))
+        self.metrics = jkbms.metrics
+        self.metrics.attach(self)
 
 
-    def is_record_start(self, record):
-        if record.startswith(SOR):
-#            log.debug("SOR found in record")
-            return True
-        return False
-
-    def recordIsComplete(self, record):
-        """"""
-        # check record starts with 'SOR'
-        if not self.is_record_start(self.notificationData):
-            self.notificationData = bytearray()
-            log.debug("No SOR found in record looking for completeness")
-            return False
-        # check that length one of the valid lengths (300, 320)
-        if len(self.notificationData) == 100 or len(self.notificationData) >= 300:
-            # check the crc/checksum is correct for the record data
-            crc = ord(self.notificationData[-1:])
-            calcCrc = crc8(self.notificationData[:-1])
-            #log.debug (crc, calcCrc, "len ", len(self.notificationData))
-            #log.debug(hexdump(self.notificationData))
-            if crc == calcCrc:
-                log.debug("Record CRC is valid")
-                return True
-        return False
-
+    def setProtocol(self, protocol):
+        '''
+        Decode the following records with the layout protocol
+        '''
+        self.protocol = protocol
+        self.cellInfoDecoder = protocol.cellInfoDecoder
+        self.infoDecoder = protocol.infoDecoder
+        self.publishPlan = self.jkbms.getPublishPlan(protocol)
+        if self.aggregator is not None:
+            self.aggregator.frequencies = {name: frequency for name, _, frequency in self.cellInfoDecoder.fields}
 
     def processExtendedRecord(self, record):
-        log.info('Processing extended record')
-        del record[0:5]
-        counter = record.pop(0)
-        log.info('Record number: {}'.format(counter))
-
-
-    def convertField(self,record,fmt,bytes,topic,name,unit):
-        value = None
-        if fmt == "Hex2Str":
-            value = Hex2Str(record[0:bytes])
-        elif fmt == "discard":
-            return []
-        elif fmt == "uptime":
-            value = uptime(record[0:bytes])
-        elif fmt == DATA_ASCII:
-            value = Hex2Ascii(record[0:bytes])
-        else:
-            fmt_split = fmt.split(":")
-            value = DecodeFormat(fmt_split[0], record[0:bytes]);
-            if len(fmt_split)>1 and fmt_split[1] == "r/1000":
-                value /= 1000
-            if len(fmt_split)>1 and fmt_split[1] == "r/10":
-                value /= 10
+        if self.logInfo:
+            log.info('Processing extended record number {}'.format(record[5]))
 
-        return value
 
+    def logFields(self, items):
+        if self.logInfo:
+            for name, unit, value in items:
+                log.info('{}: {}{}'.format(name, formatValue(value), unit))
 
-    def sendField(self,value,topic,name,unit):
-        msgs = []
-        topic = self.jkbms.tag+'/'+topic+'/'+name
-        if (unit):
-            topic+='_'+unit
-
-        if(type(value) is int):
-            log.info('{}: {:2d}{}'.format(name, value, unit))
-            msgs.append( {'topic': topic, 'payload': '{:d}'.format(value)} )
-        elif(type(value) is float):
-            msgs.append( {'topic': topic, 'payload': '{:.3f}'.format(value)} )
-            log.info('{}: {:.3f}{}'.format(name, value, unit))
-        elif(type(value) is str):
-            msgs.append( {'topic': topic, 'payload': '{}'.format(value)} )
-            log.info('{}: {}{}'.format(name, value, unit))
-        
-        if(name[0]!='-'):
-            return msgs
-        else:
-            return []
-        
     def processCellDataRecord(self, record):
-        log.info('Processing cell data record')
-        log.info('Record length {}'.format(len(record)))
+        if self.logInfo:
+            log.info('Processing cell data record, length {}'.format(len(record)))
+        if self.record_counter >= self.jkbms.records and not self.jkbms.isDaemon:
+            # Frames still queued when the wanted number of records was reached
+            return
+        # Only every recordDivider-th record is stored and published (or every record is aggregated)
         self.rx_counter += 1
-        fields = {}
-        # *opts is a catchall for all remaining arguments
-        # opts is an empty list if there is no 5th argument and evaluate to false.
-
-        for fmt,bytes,name,unit,*opts in CellInfoResponseMapping:
-            mqttFrequency = opts[0] if opts else 1
-            if (self.record_counter % mqttFrequency == 0) and (name[0]!='-'):
-#                print('* {}'.format(name))
-                fields[name] = self.convertField(record,fmt,bytes,"CellData",name,unit)
-#            else:
-#                print('_ {}'.format(name))
-            del record[0:bytes]
+        divided = self.rx_counter >= self.jkbms.recordDivider
+        if not divided and self.aggregator is None:
+            return
+        if divided:
+            self.rx_counter = 0
+        started = time.perf_counter()
+        fields = self.cellInfoDecoder.decode(record)
+        if fields is None:
+            return
+        self.metrics.observeDecode("celldata", time.perf_counter() - started)
 
         # Field BatteryPower uses only absolute values. Using BatteryCurrent to provide power direction
         if(fields["BatteryCurrent"] < 0):
             fields["BatteryPower"] = -fields["BatteryPower"]
-
-
-        msgs = []
-        for fmt,bytes,name,unit,*opts in CellInfoResponseMapping:
-            mqttFrequency = opts[0] if opts else 1
-            if (self.record_counter % mqttFrequency == 0) and (name[0]!='-'):
-                msgs += self.sendField(fields[name],"CellData",name,unit)
-
-
-        if self.rx_counter == self.jkbms.recordDivider:
-            self.rx_counter = 0
-            self.record_counter += 1
+        if divided:
+            self.store("celldata", self.cellInfoDecoder, fields)
+        self.metrics.update(self.cellInfoDecoder, fields)
+
+        now = time.monotonic()
+        if self.aggregator is not None:
+            fields = self.aggregator.add(fields, now)
+            if fields is None:
+                return
+
+        values = []
+        for entry in self.publishPlan.tick(self.record_counter):
+            # Cells beyond the enabled cell count are not decoded
+            value = fields.get(entry[0])
+            if value is None:
+                continue
+            if self.deadband is None or self.deadband.publish(entry[0], entry[1], value, now):
+                values.append((entry, value))
+
+        self.record_counter += 1
+        if self.logInfo:
+            self.logFields([(entry[0], entry[1], value) for entry, value in values])
+        msgs = self.publishPlan.serialize(values, time.time_ns())
+        if self.logDebug:
             log.debug(msgs)
-            publishToMqtt.multiple(msgs, hostname=self.jkbms.mqttBroker)
-            log.info("MQTT sent")
+        self.publish(msgs)
 
     def processInfoRecord(self, record):
-        log.info('Processing cell data record')
-        log.info('Record length {}'.format(len(record)))
+        if self.logInfo:
+            log.info('Processing info record, length {}'.format(len(record)))
+        if len(record) < self.infoDecoder.size:
+            log.warning('Info record too short to decode, need {} bytes, got {}'.format(self.infoDecoder.size, len(record)))
+            return
+        started = time.perf_counter()
+        checksum = self.protocol.identityChecksum(record)
+        changed = checksum != self.jkbms.identityChecksum
+        if changed:
+            fields = self.infoDecoder.decode(record)
+            self.jkbms.updateInfo(checksum, {name: fields[name] for name in InfoIdentityFields if name in fields})
+        else:
+            # Same identity as before, only the status fields (uptime, counters) are decoded
+            fields = self.protocol.infoStatusDecoder.decode(record)
+            fields.update(self.jkbms.info)
+        self.metrics.observeDecode("info", time.perf_counter() - started)
+        if changed and self.jkbms.autoProtocol:
+            protocol = selectProtocol(fields.get("DeviceModel"), fields.get("SoftwareVersion"))
+            if protocol is not self.protocol:
+                log.info('{} ({} firmware {}) uses layout {}'.format(self.jkbms.name, fields.get("DeviceModel"), fields.get("SoftwareVersion"), protocol.name))
+                # Kept for the following sessions of the device
+                self.jkbms.protocol = protocol
+                self.setProtocol(protocol)
+        self.store("info", self.infoDecoder, fields)
+        self.metrics.update(self.infoDecoder, fields)
+        timestamp = time.time_ns()
         msgs = []
-        for fmt,bytes,name,unit in InfoResponseMapping:
-            value = self.convertField(record,fmt,bytes,"CellData",name,unit)
-            msgs += self.sendField(value,"CellData",name,unit)
-            del record[0:bytes]
+        if changed or not self.jkbms.identityPublished:
+            # The identity is published retained, once per process and again when it changed
+            # (a cached identity only saves decoding it, new brokers still get it)
+            self.jkbms.identityPublished = True
+            items = [(name, unit, fields[name]) for name, unit, _ in self.infoDecoder.fields if name in self.jkbms.info]
+            self.logFields(items)
+            msgs = self.jkbms.serializer.serialize(self.jkbms.tag, "CellData", items, timestamp)
+            for msg in msgs:
+                msg['retain'] = True
+        items = [(name, unit, fields[name]) for name, unit, _ in self.protocol.infoStatusDecoder.fields]
+        self.logFields(items)
+        msgs += self.jkbms.serializer.serialize(self.jkbms.tag, "CellData", items, timestamp)
+        if self.logDebug:
+            log.debug(msgs)
+        self.publish(msgs)
 
-        log.debug(msgs)
-        publishToMqtt.multiple(msgs, hostname=self.jkbms.mqttBroker)
+    def store(self, table, decoder, fields):
+        if self.jkbms.sinks:
+            timestamp = time.time()
+            for sink in self.jkbms.sinks:
+                sink.write(self.jkbms.tag, table, decoder, fields, timestamp)
+
+    def publish(self, msgs):
+        if self.jkbms.publisher is None:
+            return
+        started = time.perf_counter()
+        self.jkbms.publisher.multiple(msgs)
+        self.metrics.publishLatency.observe(time.perf_counter() - started)
 
 
     def processRecord(self, record):
         recordType = record[4]
-        if self.jkbms.isDaemon:
-            systemd.daemon.notify('WATCHDOG=1')
+        # Liveness of this device, the Watchdog only pings systemd while every device is alive
+        self.jkbms.heartbeat = time.monotonic()
 
         # counter = record[5]
         if recordType == INFO_RECORD:
@@ -209,39 +244,23 @@ class jkBmsDelegate(btle.DefaultDelegate):
     def handleNotification(self, handle, data):
         # handle is the handle of the characteristic / descriptor that posted the notification
         # data is the data in this notification - may take multiple notifications to get all of a message
-        log.debug("From handle: {:#04x} Got {} bytes of data".format(handle, len(data)))
-        self.notificationData += bytearray(data)
-        log.debug(f"Pre wipe to start {self.notificationData}")
-        self.notificationData = self.wipe_to_start(self.notificationData)
-        log.debug(f"Post wipe to start {self.notificationData}")
-
-        if not self.is_record_correct_type(
-            self.notificationData, self.record_type
-        ):
-            log.debug(
-                f"Not expected type of record - wiping data {self.notificationData}"
-            )
-            self.notificationData = bytearray()
-        if self.recordIsComplete(self.notificationData):
-            self.jkbms.record = self.notificationData
-            log.debug("record complete")
-            self.notificationData = bytearray()
-            self.processRecord(self.jkbms.record)
-
-    def wipe_to_start(self, record):
-        sor_loc = record.find(SOR)
-        if sor_loc == -1:
-            log.debug("SOR not found in record")
-            return bytearray()
-        return record[sor_loc:]
-    
-    def is_record_correct_type(self, record, type):
-        if len(record) < len(SOR):
-            return False
-        if record[len(SOR)] == int(type):
-            log.debug(f"Record is type {type}")
-            return True
-        return False
+        if self.logDebug:
+            log.debug("From handle: %#04x Got %d bytes of data", handle, len(data))
+        if self.trace is not None:
+            self.trace.notification(data)
+        self.metrics.notifications += 1
+        self.metrics.bytes += len(data)
+        self.frames.append(data)
+        frame = self.frames.frame(self.record_types)
+        while frame is not None:
+            self.metrics.frames += 1
+            self.received[frame[RECORD_TYPE_OFFSET]] += 1
+            # The frame buffer is reused, hand a single copy of the frame to the worker
+            self.jkbms.record = bytes(frame)
+            if self.trace is not None:
+                self.trace.frame(self.jkbms.record)
+            self.worker.submit(self.jkbms.record)
+            frame = self.frames.frame(self.record_types)
 
 
 class jkBMS:
@@ -251,9 +270,9 @@ class jkBMS:
     """
 
     def __str__(self):
-        return 'JKBMS instance --- name: {}, model: {}, mac: {}, command: {}, tag: {}, format: {}, records: {}, maxConnectionAttempts: {}, mqttBroker: {}'.format(self.name, self.model, self.mac, self.command, self.tag, self.format, self.records, self.maxConnectionAttempts, self.mqttBroker)
+        return 'JKBMS instance --- name: {}, model: {}, mac: {}, command: {}, tag: {}, format: {}, records: {}, maxConnectionAttempts: {}, mqttBroker: {}, adapter: {}, transport: {}'.format(self.name, self.model, self.mac, self.command, self.tag, self.format, self.records, self.maxConnectionAttempts, self.mqttBroker, self.adapter, self.transport.__class__.__name__)
 
-    def __init__(self, name, model, mac, command, tag, format, records=1, recordDivider=1, maxConnectionAttempts=3, mqttBroker=None, daemon=False):
+    def __init__(self, name, model, mac, command, tag, format, records=1, recordDivider=1, maxConnectionAttempts=3, mqttBroker=None, daemon=False, publisher=None, queueSize=16, queuePolicy=DROP_OLDEST, adapter=None, transport=BLE, transportOptions=None, deadband=None, deadbandMaxAge=300, sinks=None, aggregateWindow=0, traceSize=0, traceSample=1, protocol=AUTO, commandTimeout=5.0, infoInterval=3600, infoCache=None):
         '''
         '''
         self.name = name
@@ -264,97 +283,131 @@ class jkBMS:
         self.format = format
         self.recordDivider = recordDivider
         self.isDaemon = daemon
+        # time.monotonic() of the last record (start time until the first one)
+        self.heartbeat = time.monotonic()
         try:
             self.records = int(records)
         except Exception:
             self.records = 1
         self.maxConnectionAttempts = maxConnectionAttempts
         self.mqttBroker = mqttBroker
-        self.device = btle.Peripheral(None)
-        log.debug('Config data - name: {}, model: {}, mac: {}, command: {}, tag: {}, format: {}'.format(self.name, self.model, self.mac, self.command, self.tag, self.format))
-        log.debug('Additional config - records: {}, maxConnectionAttempts: {}, mqttBroker: {}'.format(self.records, self.maxConnectionAttempts, self.mqttBroker))
-        print('jkBMS Logging level: {}'.format(log.level))
-        print('daemonize: {}'.format(self.isDaemon))
+        self.publisher = publisher
+        self.queueSize = queueSize
+        self.queuePolicy = queuePolicy
+        # {unit: threshold} for change-only publishing, None publishes every value
+        self.deadband = deadband
+        self.deadbandMaxAge = deadbandMaxAge
+        # Seconds of records summarised per publish, 0 publishes sampled records
+        self.aggregateWindow = aggregateWindow
+        # Local storage sinks receiving every decoded record
+        self.sinks = sinks or []
+        # Pipeline counters and latest values, served by the metrics endpoint
+        self.metrics = DeviceMetrics(self)
+        # Ring buffer of raw notifications / frames dumped on SIGUSR1, None disables tracing
+        self.trace = FrameTrace(name, traceSize, traceSample) if traceSize else None
+        # HCI adapter number (hciN), None uses the default adapter
+        self.adapter = adapter
+        self.serializer = createSerializer(format)
+        # Seconds to wait for the answer of a command, seconds between getInfo requests within a session (0: once)
+        self.commandTimeout = commandTimeout
+        self.infoInterval = infoInterval
+        self.scheduler = None
+        self.delegate = None
+        # Frame layout, 'auto' starts with the default layout and selects one from the first info record
+        self.autoProtocol = protocol is None or protocol == AUTO
+        self.protocol = getProtocol(protocol)
+        if self.autoProtocol and model:
+            # Until the first info record, the configured model may already tell the layout
+            self.protocol = selectProtocol(model)
+        # Identity fields (model, firmware, ...) of the last info record and the checksum of their bytes
+        self.infoCache = infoCache
+        self.info = {}
+        self.identityChecksum = None
+        self.identityPublished = False
+        cached = infoCache.get(mac) if infoCache is not None and mac else None
+        if cached is not None:
+            self.info = cached['fields']
+            self.identityChecksum = cached['checksum']
+            if self.autoProtocol:
+                # Known device, decode the first records in its layout already
+                self.protocol = selectProtocol(self.info.get("DeviceModel"), self.info.get("SoftwareVersion"))
+        # layout name: PublishPlan of the cell data records
+        self.publishPlans = {}
+        self.transportName = transport
+        self.transport = createTransport(self, transport, **(transportOptions or {}))
+        log.debug('Config data - name: %s, model: %s, mac: %s, command: %s, tag: %s, format: %s', self.name, self.model, self.mac, self.command, self.tag, self.format)
+        log.debug('Additional config - records: %s, maxConnectionAttempts: %s, mqttBroker: %s, daemonize: %s', self.records, self.maxConnectionAttempts, self.mqttBroker, self.isDaemon)
+
+    def getPublishPlan(self, protocol):
+        '''
+        Publish plan of the cell data records in the layout of protocol, built once per layout
+        '''
+        plan = self.publishPlans.get(protocol.name)
+        if plan is None:
+            decoder = protocol.cellInfoDecoder
+            fields = decoder.fields
+            if self.aggregateWindow:
+                fields = Aggregator.summaryFields(fields, decoder.types)
+            plan = self.publishPlans[protocol.name] = self.serializer.plan(self.tag, "CellData", fields, decoder.types)
+        return plan
+
+    def updateInfo(self, checksum, info):
+        '''
+        Remember a changed device identity, persisted per MAC in the info cache
+        '''
+        log.info('{} identity: {}'.format(self.name, info))
+        self.info = info
+        self.identityChecksum = checksum
+        if self.infoCache is not None and self.mac:
+            self.infoCache.put(self.mac, checksum, info)
+
+    def publishLink(self, items):
+        '''
+        Publish connection statistics (name, unit, value) on <tag>/Link
+        '''
+        if self.publisher is None:
+            return
+        self.publisher.multiple(self.serializer.serialize(self.tag, "Link", items, time.time_ns()))
 
     def connect(self):
-        if self.isDaemon:
-            time.sleep(10)
-        # Intialise BLE device
-        self.device = btle.Peripheral(None)
         self.delegate = jkBmsDelegate(self)
-        self.device.withDelegate(self.delegate)
-        # Connect to BLE Device
-        connected = False
-        attempts = 0
-        log.info('Attempting to connect to {}'.format(self.name))
-        while not connected:
-            attempts += 1
-            if attempts > self.maxConnectionAttempts:
-                log.warning('Cannot connect to {} with mac {} - exceeded {} attempts'.format(self.name, self.mac, attempts - 1))
-                return connected
-            try:
-                self.device.connect(self.mac)
-                self.device.setMTU(330)
-                connected = True
-            except Exception:
-                continue
-        return connected
-    
+        return self.transport.connect(self.delegate)
+
 
     def getBLEData(self):
-        # Get the device name
-        serviceId = self.device.getServiceByUUID(btle.AssignedNumbers.genericAccess)
-        deviceName = serviceId.getCharacteristics(btle.AssignedNumbers.deviceName)[0]
-        log.info('Connected to {}'.format(deviceName.read()))
-
-        # Connect to the notify service
-        serviceNotifyUuid = 'ffe0'
-        serviceNotify = self.device.getServiceByUUID(serviceNotifyUuid)
-
-        # Get the handles that we need to talk to
-        # Read
-        characteristicReadUuid = 'ffe1' # Grypho: Adopted to newer BMS systems
-        characteristicRead = serviceNotify.getCharacteristics(characteristicReadUuid)[0]
-        handleRead = characteristicRead.getHandle()
-        log.info('Read characteristic: {}, handle {:x}'.format(characteristicRead, handleRead))
-
-        # ## TODO sort below
-        # Need to dynamically find this handle....
-        log.info('Enable 0x0b handle', self.device.writeCharacteristic(0x0b, b'\x01\x00'))
-        log.info('Enable read handle', self.device.writeCharacteristic(handleRead, b'\x01\x00'))
-        self.delegate.record_type = 0x03
-        log.info('Write getInfo to read handle', self.device.writeCharacteristic(handleRead, getInfo))
-        secs = 0
-        while True:
-            if self.device.waitForNotifications(1.0):
-                continue
-            secs += 1
-            if secs > 5:
-                break
+        self.delegate.worker.start()
+        try:
+            self.readBLEData()
+        finally:
+            self.delegate.worker.stop()
 
-        self.delegate.record_type = 0x02
-        log.info('Write getCellInfo to read handle', self.device.writeCharacteristic(handleRead, getCellInfo))
-        loops = 0
-        recordsToGrab = self.records
+    def commands(self):
+        '''
+        Commands of a session: getInfo first (re-issued every infoInterval seconds), then the cell data stream
+        '''
+        return [
+            Command('getInfo', getInfo, INFO_RECORD, priority=0, timeout=self.commandTimeout, interval=self.infoInterval),
+            Command('getCellInfo', getCellInfo, CELL_DATA, priority=1, timeout=self.commandTimeout, stream=True),
+        ]
 
+    def ready(self):
         if self.isDaemon:
             # Tell systemd that our service is ready
-            systemd.daemon.notify('READY=1')
-
+            systemdNotify('READY=1')
+        log.info('Grabbing {} (every {}th) records (after inital response)'.format(self.records, self.recordDivider))
 
-        log.info('Grabbing {} (every {}th) records (after inital response)'.format(recordsToGrab, self.recordDivider))
+    def sessionDone(self):
+        if self.delegate.record_counter >= self.records and not self.isDaemon:
+            log.info('Got {} records'.format(self.records))
+            return True
+        return False
 
-        while True:
-            loops += 1
-            if self.delegate.record_counter >= recordsToGrab and not self.isDaemon:
-                log.info('Got {} records'.format(recordsToGrab))
-                break
-            if self.device.waitForNotifications(1.0):
-                continue
+    def readBLEData(self):
+        self.transport.start()
+        self.scheduler = CommandScheduler(self.transport, self.delegate, self.commands())
+        self.scheduler.run(self.sessionDone, onReady=self.ready)
 
     def disconnect(self):
         log.info('Disconnecting...')
-        self.device.disconnect()
-        if self.isDaemon:
-            time.sleep(10)
+        self.transport.disconnect()
             
@@ -2,24 +2,28 @@ from .jkbmsdecode import DATA_ASCII, DATA_INT16_DIV10, DATA_INT32_DIV1000, DATA_
 
 
 InfoResponseMapping = [
-    ["Hex2Str", 4, "-Header", ""],
-    ["Hex2Str", 1, "-Record Type", ""],
-    [DATA_UINT8, 1, "RecordCounter", ""],
-    [DATA_ASCII, 16, "DeviceModel", ""],
-    [DATA_ASCII, 8, "HardwareVersion", ""],
-    [DATA_ASCII, 8, "SoftwareVersion", ""],
-    ["uptime", 4, "Uptime", "s"],
-    [DATA_UINT32, 4, "PowerOnTimes", ""],
-    [DATA_ASCII, 16, "DeviceName", ""],
-    [DATA_ASCII, 16, "-DevicePasscode", ""],
-    [DATA_ASCII, 8, "ManufacturingDate", ""],
-    [DATA_ASCII, 11, "SerialNumber", ""],
-    [DATA_ASCII, 5, "-Passcode", ""],
-    [DATA_ASCII, 16, "-UserData", ""],
-    [DATA_ASCII, 16, "-Setup Passcode", ""],
-    ["discard", 672, "unknown", ""],
+    ("Hex2Str", 4, "-Header", ""),
+    ("Hex2Str", 1, "-Record Type", ""),
+    (DATA_UINT8, 1, "RecordCounter", ""),
+    (DATA_ASCII, 16, "DeviceModel", ""),
+    (DATA_ASCII, 8, "HardwareVersion", ""),
+    (DATA_ASCII, 8, "SoftwareVersion", ""),
+    ("uptime", 4, "Uptime", "s"),
+    (DATA_UINT32, 4, "PowerOnTimes", ""),
+    (DATA_ASCII, 16, "DeviceName", ""),
+    (DATA_ASCII, 16, "-DevicePasscode", ""),
+    (DATA_ASCII, 8, "ManufacturingDate", ""),
+    (DATA_ASCII, 11, "SerialNumber", ""),
+    (DATA_ASCII, 5, "-Passcode", ""),
+    (DATA_ASCII, 16, "-UserData", ""),
+    (DATA_ASCII, 16, "-Setup Passcode", ""),
+    ("discard", 672, "unknown", ""),
 ]
 
+# Static identity fields of the info record, the other info fields (uptime, counters) change with every record
+InfoIdentityFields = ("DeviceModel", "HardwareVersion", "SoftwareVersion", "DeviceName", "ManufacturingDate", "SerialNumber")
+
+# JK02_32S layout (firmware >= 11): 32 cell slots per block
 CellInfoResponseMapping = [
     ("Hex2Str", 4, "-Header", ""),
     ("Hex2Str", 1, "-Record_Type", ""),
@@ -142,4 +146,148 @@ CellInfoResponseMapping = [
     ("discard", 4, "-Unknown40", ""),
     ("discard", 4, "-Unknown41", ""),
     ("discard", 45, "-UnknownXX", ""),
-]
\ No newline at end of file
+]
+
+# JK02_24S layout (firmware < 11): 24 cell slots per block, all following fields 32 bytes earlier
+CellInfoResponseMapping24S = [
+    ("Hex2Str", 4, "-Header", ""),
+    ("Hex2Str", 1, "-Record_Type", ""),
+    (DATA_UINT8, 1, "Record_Counter", "", EVERY60TH),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell01", "V", EVERY5TH),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell02", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell03", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell04", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell05", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell06", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell07", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell08", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell09", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell10", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell11", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell12", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell13", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell14", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell15", "V"),
+    (DATA_UINT16_DIV1000, 2, "VoltageCell16", "V"),
+    (DATA_UINT16_DIV1000, 2, "-VoltageCell17", "V"),
+    (DATA_UINT16_DIV1000, 2, "-VoltageCell18", "V"),
+    (DATA_UINT16_DIV1000, 2, "-VoltageCell19", "V"),
+    (DATA_UINT16_DIV1000, 2, "-VoltageCell20", "V"),
+    (DATA_UINT16_DIV1000, 2, "-VoltageCell21", "V"),
+    (DATA_UINT16_DIV1000, 2, "-VoltageCell22", "V"),
+    (DATA_UINT16_DIV1000, 2, "-VoltageCell23", "V"),
+    (DATA_UINT16_DIV1000, 2, "-VoltageCell24", "V"),
+    ("Hex2Str", 4, "EnabledCellsBitmask", "", EVERY60TH), #0xFF000000 => 8 cells, 0xFF010000 => 9 cells, ..., 0xFFFF0000 => 16cells
+    (DATA_UINT16_DIV1000, 2, "AverageCellVoltage", "V"),
+    (DATA_UINT16_DIV1000, 2, "DeltaCellVoltage", "V"),
+    (DATA_UINT16_DIV1000, 2, "CurrentBalancer", "A"),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell01", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell02", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell03", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell04", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell05", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell06", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell07", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell08", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell09", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell10", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell11", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell12", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell13", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell14", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell15", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "ResistanceCell16", "Ohm",EVERY10TH),
+    (DATA_UINT16_DIV1000, 2, "-ResistanceCell17", "Ohm"),
+    (DATA_UINT16_DIV1000, 2, "-ResistanceCell18", "Ohm"),
+    (DATA_UINT16_DIV1000, 2, "-ResistanceCell19", "Ohm"),
+    (DATA_UINT16_DIV1000, 2, "-ResistanceCell20", "Ohm"),
+    (DATA_UINT16_DIV1000, 2, "-ResistanceCell21", "Ohm"),
+    (DATA_UINT16_DIV1000, 2, "-ResistanceCell22", "Ohm"),
+    (DATA_UINT16_DIV1000, 2, "-ResistanceCell23", "Ohm"),
+    (DATA_UINT16_DIV1000, 2, "-ResistanceCell24", "Ohm"),
+    ("Hex2Str", 6, "-discard2", ""),
+    (DATA_UINT32_DIV1000, 4, "BatteryVoltage", "V"),
+    (DATA_UINT32_DIV1000, 4, "BatteryPower", "W"),
+    (DATA_INT32_DIV1000, 4, "BatteryCurrent", "A"),  # signed int32, positive: charge, negative: discharge
+    # ("discard", 8, "discard3", ""),
+    (DATA_INT16_DIV10, 2, "BatteryT1", "C", EVERY60TH),
+    (DATA_INT16_DIV10, 2, "BatteryT2", "C", EVERY60TH),
+    (DATA_INT16_DIV10, 2, "MOSTemp", "C", EVERY60TH),
+    ("Hex2Str", 2, "-Unknown3", ""), #0x0001 charge overtemp, 0x0002 charge undertemp. 0x0008 cell undervoltage, 0x0400 cell count error, 0x0800 current sensor anomaly, 0x1000 cell overvoltage
+    ("discard", 2, "-discard4", ""),  # discard4
+    ("discard", 1, "-discard4_1", ""),  # added
+    (DATA_UINT8, 1, "PercentRemain", "Pct", EVERY5TH),
+    (DATA_UINT32_DIV1000, 4, "CapacityRemain", "Ah", EVERY5TH),  # Unknown6+7
+    (DATA_UINT32_DIV1000, 4, "NominalCapacity", "Ah", EVERY60TH),  # Unknown8+9
+    (DATA_UINT32, 4, "CycleCount", "", EVERY60TH),
+    # ("discard", 2, "Unknown10", ""),
+    # ("discard", 2, "Unknown11", ""),
+    (DATA_UINT32_DIV1000, 4, "CycleCapacity", "Ah", EVERY60TH),  # Unknown10+11
+    ("discard", 2, "-Unknown12", ""),
+    ("discard", 2, "-Unknown13", ""),
+    ("uptime", 3, "Uptime", "s"),
+    ("discard", 2, "-Unknown15", ""),
+    ("discard", 2, "-Unknown16", ""),
+    ("discard", 2, "-Unknown17", ""),
+    ("discard", 12, "-discard6", ""),
+    ("discard", 2, "-Unknown18", ""),
+    ("discard", 2, "-Unknown19", ""),
+    ("discard", 2, "-Unknown20", ""),
+    (DATA_UINT16_DIV1000, 2, "CurrentCharge", "A"),  # Unknown21
+    (DATA_UINT16_DIV1000, 2, "CurrentDischarge", "A"),  # Unknown22
+    ("discard", 2, "-Unknown23", ""),
+    ("discard", 2, "-Unknown24", ""),
+    ("discard", 2, "-Unknown25", ""),
+    ("discard", 2, "-Unknown26", ""),
+    ("discard", 2, "-Unknown27", ""),
+    ("discard", 2, "-Unknown28", ""),
+    ("discard", 2, "-Unknown29", ""),
+    ("discard", 4, "-Unknown30", ""),
+    ("discard", 4, "-Unknown31", ""),
+    ("discard", 4, "-Unknown32", ""),
+    ("discard", 4, "-Unknown33", ""),
+    ("discard", 4, "-Unknown34", ""),
+    ("discard", 4, "-Unknown35", ""),
+    ("discard", 4, "-Unknown36", ""),
+    ("discard", 4, "-Unknown37", ""),
+    ("discard", 4, "-Unknown38", ""),
+    ("discard", 4, "-Unknown39", ""),
+    ("discard", 4, "-Unknown40", ""),
+    ("discard", 4, "-Unknown41", ""),
+    ("discard", 77, "-UnknownXX", ""),
+]
+
+# Numbered cell blocks of CellInfoResponseMapping decoded as arrays for the enabled cells only
+CellArrays = ("VoltageCell", "ResistanceCell")
+# Bitmask of the enabled cells, the number of set bits is the cell count
+CellCountField = "EnabledCellsBitmask"
+
+# Statistics derived from the first cell block (the cell voltages)
+CellStatisticsMapping = [
+    ("count", "CellCount", "", EVERY60TH),
+    ("min", "CellVoltageMin", "V"),
+    ("max", "CellVoltageMax", "V"),
+    ("argmin", "CellVoltageMinCell", ""),
+    ("argmax", "CellVoltageMaxCell", ""),
+    ("stddev", "CellVoltageStdDev", "V"),
+    ("imbalance", "CellVoltageImbalance", "V"),
+]
+
+# Frame layouts: name: (cell data mapping, info mapping)
+ProtocolLayouts = {
+    "JK02_24S": (CellInfoResponseMapping24S, InfoResponseMapping),
+    "JK02_32S": (CellInfoResponseMapping, InfoResponseMapping),
+}
+# Layout selection: (model prefix, minimum cell count of the model, minimum SoftwareVersion major, layout), first match wins
+# - models are compared as JK_<hardware>, the cell count is the <n>S of the model (JK_B2A24S15P: 24)
+# - without a firmware version (only the configured model known) only rules with a prefix or a cell count apply
+ProtocolRules = [
+    # More cells than the 24 cell layout holds
+    ("", 25, 0, "JK02_32S"),
+    # PB series (inverter BMS) only exists with the 32 cell layout
+    ("JK_PB", 0, 0, "JK02_32S"),
+    ("", 0, 11, "JK02_32S"),
+    ("", 0, 0, "JK02_24S"),
+]
+# Layout used until the first info record was decoded, if the configured model does not select one
+DefaultProtocol = "JK02_32S"
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import logging
 import math
-from struct import unpack, calcsize
+from struct import Struct, unpack, calcsize
 log = logging.getLogger('JKBMS-BT')
 
 DATA_UINT8 = "<B"
@@ -25,27 +25,17 @@ EVERY60TH = 60
 def crc8(byteData):
     '''
     Generate 8 bit CRC of supplied string
+    - the JKBMS "CRC" is the sum of all bytes, summed in C by sum()
     '''
-    CRC = 0
-    # for j in range(0, len(str),2):
-    for b in byteData:
-        # char = int(str[j:j+2], 16)
-        # print(b)
-        CRC = CRC + b
-        CRC &= 0xff
-    return CRC
+    return sum(byteData) & 0xff
 
 def Hex2Ascii(hexString):
     """
     Return the hexString as ASCII, ie 0x4a -> J
     """
-    answer = ""
-    for x in hexString:
-        if x != 0:
-            # Ignore 0x00 results
-            answer += f"{x:c}"
-
-    log.debug(f"Hex {hexString} decoded to {answer}")
+    # Ignore 0x00 bytes, latin-1 maps every byte to the code point of the same value
+    answer = bytes(hexString).replace(b"\x00", b"").decode("latin-1")
+    log.debug("Hex %s decoded to %s", hexString, answer)
 
     return answer
 
@@ -54,7 +44,7 @@ def Hex2Int(hexString):
     Decode the first byte of a hexString to int
     """
     answer = hexString[0]
-    log.debug(f"Hex {hexString} decoded to {answer}")
+    log.debug("Hex %s decoded to %s", hexString, answer)
 
     return answer
 
@@ -63,11 +53,8 @@ def Hex2Str(hexString):
     """
     Return the hexString as ASCII representation of hex, ie 0x4a -> 4a
     """
-    answer = ""
-    for x in hexString:
-        answer += f"{x:02x}"
-
-    log.debug(f"Hex {hexString} decoded to {answer}")
+    answer = bytes(hexString).hex()
+    log.debug("Hex %s decoded to %s", hexString, answer)
 
     return answer
 
@@ -77,10 +64,10 @@ def LittleHex2Short(hexString):
     """
     # Make sure supplied String is the correct length
     if len(hexString) != 2:
-        log.info(f"Hex encoded value must be 2 bytes long. Was {len(hexString)} length")
+        log.info("Hex encoded value must be 2 bytes long. Was %s length", len(hexString))
         return 0
     answer = unpack(DATA_INT16, hexString)[0]
-    log.debug(f"Hex {hexString} 2 byte decoded to {answer}")
+    log.debug("Hex %s 2 byte decoded to %s", hexString, answer)
     return answer
 
 def LittleHex2Int(hexString):
@@ -89,11 +76,11 @@ def LittleHex2Int(hexString):
     """
     # Make sure supplied String is the correct length
     if len(hexString) != 4:
-        log.info(f"Hex encoded value must be 4 bytes long. Was {len(hexString)} length")
+        log.info("Hex encoded value must be 4 bytes long. Was %s length", len(hexString))
         return 0
 
     answer = unpack(DATA_INT32, hexString)[0]
-    log.debug(f"Hex {hexString} 4 byte decoded to {answer}")
+    log.debug("Hex %s 4 byte decoded to %s", hexString, answer)
     return answer
 
 def LittleHex2UInt(hexString):
@@ -102,24 +89,19 @@ def LittleHex2UInt(hexString):
     """
     # Make sure supplied String is the correct length
     if len(hexString) != 4:
-        log.info(f"Hex encoded value must be 4 bytes long. Was {len(hexString)} length")
+        log.info("Hex encoded value must be 4 bytes long. Was %s length", len(hexString))
         return 0
 
     answer = unpack(DATA_UINT32, hexString)[0]
-    log.debug(f"Hex {hexString} 4 byte decoded to {answer}")
+    log.debug("Hex %s 4 byte decoded to %s", hexString, answer)
     return answer
 
 def uptime(byteData):
     """
-    Decode 3 hex bytes to a JKBMS uptime
+    Decode 3 or 4 little endian hex bytes to a JKBMS uptime (seconds)
     """
-    # Make sure supplied String is the correct length
-    log.debug("uptime defn")
-    value = 0
-    for x, b in enumerate(byteData):
-        # b = byteData.pop(0)
-        value += b * 256 ** x
-        log.debug(f"Uptime int value {value} for pos {x}")
+    value = int.from_bytes(byteData, "little")
+    log.debug("Uptime %s decoded to %s", byteData, value)
     return value
 #    daysFloat = value / (60 * 60 * 24)
 #    days = math.trunc(daysFloat)
@@ -137,12 +119,212 @@ def uptime(byteData):
 def DecodeFormat(fmt, hexString):
     # Make sure supplied String is the correct length
     if len(fmt) != 2:
-        log.error(f"Invalid format {fmt}!")
+        log.error("Invalid format %s!", fmt)
 
     size = calcsize(fmt)
     if len(hexString) != size:
-        log.info(f"Hex encoded value must be {size} bytes long. Was {len(hexString)} length")
+        log.info("Hex encoded value must be %s bytes long. Was %s length", size, len(hexString))
         return 0
     answer = unpack(fmt, hexString)[0]
-    log.debug(f"Hex {hexString} {size} byte decoded to {answer}")
+    log.debug("Hex %s %s byte decoded to %s", hexString, size, answer)
     return answer
+
+
+class RecordDecoder:
+    '''
+    Decoder compiled once from a response mapping table
+    - all numeric fields are unpacked in one pass with a single struct.Struct
+    - string style fields (Hex2Str, ASCII, uptime) are sliced from a memoryview at precomputed offsets
+    - hidden ('-' prefixed) and discard fields are skipped, the record is never copied or modified
+    '''
+    def __init__(self, mapping):
+        structFmt = "<"
+        offset = 0
+        end = 0
+        index = 0
+        # steps: (name, struct index, divisor, converter, start, stop)
+        self.steps = []
+        # fields: (name, unit, frequency) of all published fields in mapping order
+        self.fields = []
+        # types: name: python type (int, float or str) of the decoded value
+        self.types = {}
+        for fmt, size, name, unit, *opts in mapping:
+            if fmt == "discard" or name[0] == '-':
+                offset += size
+                continue
+            converter = None
+            divisor = None
+            if fmt == "Hex2Str":
+                converter = Hex2Str
+            elif fmt == "uptime":
+                converter = uptime
+            elif fmt == DATA_ASCII:
+                converter = Hex2Ascii
+            else:
+                fmt_split = fmt.split(":")
+                if len(fmt_split[0]) != 2 or calcsize(fmt_split[0]) != size:
+                    raise ValueError(f"Invalid format {fmt} for field {name}")
+                if len(fmt_split) > 1:
+                    divisor = int(fmt_split[1].split("/")[1])
+                if offset > end:
+                    structFmt += f"{offset - end}x"
+                structFmt += fmt_split[0][1]
+                end = offset + size
+            if converter is None:
+                self.steps.append((name, index, divisor, None, offset, offset + size))
+                self.types[name] = float if divisor else int
+                index += 1
+            else:
+                self.steps.append((name, None, None, converter, offset, offset + size))
+                self.types[name] = int if converter is uptime else str
+            self.fields.append((name, unit, opts[0] if opts else 1))
+            offset += size
+        self.struct = Struct(structFmt)
+        # Minimum record length needed to decode every published field
+        self.size = max([self.struct.size] + [step[5] for step in self.steps])
+
+    def decode(self, record):
+        '''
+        Decode record (bytes, bytearray or memoryview) to a dict of name: value
+        '''
+        if len(record) < self.size:
+            log.warning(f"Record too short to decode, need {self.size} bytes, got {len(record)}")
+            return None
+        view = memoryview(record)
+        values = self.struct.unpack_from(view)
+        fields = {}
+        for name, index, divisor, converter, start, stop in self.steps:
+            if converter is None:
+                value = values[index]
+                if divisor:
+                    value /= divisor
+            else:
+                value = converter(view[start:stop])
+            fields[name] = value
+        return fields
+
+
+class CellDataDecoder(RecordDecoder):
+    '''
+    RecordDecoder for cell data records
+    - numbered cell blocks (e.g. VoltageCell01..32) are unpacked as one array per block for the enabled cells only,
+      the number of cells is the number of bits set in the countField bitmask
+    - hidden entries of a block are decoded too when the cell is enabled
+    - statistics (count, min, max, argmin, argmax, stddev, imbalance) of the first block are added as fields
+    '''
+    def __init__(self, mapping, arrays, countField, statistics):
+        scalarMapping = []
+        blocks = {}
+        layout = []
+        offset = 0
+        self.countOffset = None
+        for fmt, size, name, unit, *opts in mapping:
+            plainName = name.lstrip('-')
+            prefix = next((p for p in arrays if plainName.startswith(p) and plainName[len(p):].isdigit()), None)
+            if prefix is None:
+                if plainName == countField:
+                    self.countOffset = (offset, offset + size)
+                scalarMapping.append((fmt, size, name, unit, *opts))
+                layout.append(name)
+            else:
+                block = blocks.get(prefix)
+                if block is None:
+                    block = blocks[prefix] = {'fmt': fmt, 'size': size, 'offset': offset, 'fields': []}
+                elif fmt != block['fmt'] or offset != block['offset'] + len(block['fields']) * size:
+                    raise ValueError(f"Cell block {prefix} is not contiguous at field {name}")
+                # Hidden entries inherit the frequency of the entry before them
+                if opts:
+                    frequency = opts[0]
+                elif name[0] == '-' and block['fields']:
+                    frequency = block['fields'][-1][2]
+                else:
+                    frequency = 1
+                block['fields'].append((plainName, unit, frequency))
+                scalarMapping.append(("discard", size, name, unit))
+                layout.append(block['fields'][-1])
+            offset += size
+        RecordDecoder.__init__(self, scalarMapping)
+
+        # arrays: (names, start, struct format character, itemsize, divisor)
+        self.arrays = []
+        self.arrayStructs = {}
+        for prefix in arrays:
+            block = blocks[prefix]
+            fmt_split = block['fmt'].split(":")
+            if len(fmt_split[0]) != 2 or calcsize(fmt_split[0]) != block['size']:
+                raise ValueError(f"Invalid array format {block['fmt']} for cell block {prefix}")
+            divisor = int(fmt_split[1].split("/")[1]) if len(fmt_split) > 1 else None
+            names = [name for name, _, _ in block['fields']]
+            self.arrays.append((names, block['offset'], fmt_split[0][1], block['size'], divisor))
+            for name in names:
+                self.types[name] = float if divisor else int
+        self.maxCells = min(len(names) for names, *_ in self.arrays)
+
+        # Rebuild the published fields in mapping order, followed by the statistics
+        scalarFields = {field[0]: field for field in self.fields}
+        self.fields = []
+        for entry in layout:
+            if type(entry) is tuple:
+                self.fields.append(entry)
+            elif entry in scalarFields:
+                self.fields.append(scalarFields[entry])
+        statisticsDivisor = self.arrays[0][4]
+        # statistics: (statistic, name)
+        self.statistics = []
+        for statistic, name, unit, *opts in statistics:
+            self.statistics.append((statistic, name))
+            self.fields.append((name, unit, opts[0] if opts else 1))
+            if statistic in ("count", "argmin", "argmax"):
+                self.types[name] = int
+            elif statistic == "stddev" or statisticsDivisor:
+                self.types[name] = float
+            else:
+                self.types[name] = int
+        self.size = max(self.size, max(start + len(names) * itemsize for names, start, _, itemsize, _ in self.arrays))
+
+    def decode(self, record):
+        fields = RecordDecoder.decode(self, record)
+        if fields is None:
+            return None
+        view = memoryview(record)
+        count = self.maxCells
+        if self.countOffset is not None:
+            bitmask = int.from_bytes(view[self.countOffset[0]:self.countOffset[1]], 'little')
+            count = min(count, bin(bitmask).count('1'))
+        statisticsValues = None
+        for names, start, code, itemsize, divisor in self.arrays:
+            # One Struct per (block, cell count), unpacks the whole block in one call
+            key = (start, count)
+            blockStruct = self.arrayStructs.get(key)
+            if blockStruct is None:
+                blockStruct = self.arrayStructs[key] = Struct(f"<{count}{code}")
+            values = blockStruct.unpack_from(view, start)
+            if statisticsValues is None:
+                statisticsValues = values
+            if divisor:
+                fields.update(zip(names, [value / divisor for value in values]))
+            else:
+                fields.update(zip(names, values))
+        if count:
+            self.addStatistics(fields, statisticsValues, count, self.arrays[0][4])
+        return fields
+
+    def addStatistics(self, fields, values, count, divisor):
+        low = min(values)
+        high = max(values)
+        mean = sum(values) / count
+        variance = max(sum([value * value for value in values]) / count - mean * mean, 0)
+        results = {
+            "count": count,
+            "min": low,
+            "max": high,
+            "argmin": values.index(low) + 1,
+            "argmax": values.index(high) + 1,
+            "stddev": math.sqrt(variance),
+            "imbalance": high - low,
+        }
+        for statistic, name in self.statistics:
+            value = results[statistic]
+            if statistic not in ("count", "argmin", "argmax"):
+                value = value / divisor if divisor else value
+            fields[name] = value
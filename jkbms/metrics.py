@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+import logging
+import threading
+from bisect import bisect_left
+
+log = logging.getLogger('JKBMS-BT')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds, decoding takes tens of microseconds, publishing up to the MQTT timeouts
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def escapeLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values):
+    return '{' + ','.join('{}="{}"'.format(key, escapeLabel(value)) for key, value in values.items()) + '}'
+
+
+class Histogram:
+    '''
+    Fixed bucket histogram in the Prometheus sense (cumulative buckets, sum and count)
+    - observe() is called by a single thread (the record worker of a device), no locking
+    '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labelValues):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(name, labels(**labelValues, le=bound), cumulative))
+        lines.append('{}_sum{} {}'.format(name, labels(**labelValues), self.sum))
+        lines.append('{}_count{} {}'.format(name, labels(**labelValues), self.count))
+        return lines
+
+
+class DeviceMetrics:
+    '''
+    Pipeline counters, latencies and the latest decoded values of one JKBMS
+    - counters are cumulative over all sessions of the device, the frame buffer and record worker
+      counters of finished sessions are folded in when a new delegate attaches
+    '''
+
+    def __init__(self, jkbms):
+        self.jkbms = jkbms
+        self.delegate = None
+        self.notifications = 0
+        self.bytes = 0
+        self.frames = 0
+        self.resyncs = 0
+        self.checksumFailures = 0
+        self.overflows = 0
+        self.dropped = 0
+        self.decodeLatency = {}
+        self.publishLatency = Histogram()
+        self.values = {}
+        self.info = {}
+
+    def attach(self, delegate):
+        if self.delegate is not None:
+            frames = self.delegate.frames
+            self.resyncs += frames.resyncs
+            self.checksumFailures += frames.checksumFailures
+            self.overflows += frames.overflows
+            self.dropped += self.delegate.worker.dropped
+        self.delegate = delegate
+
+    def observeDecode(self, record, seconds):
+        histogram = self.decodeLatency.get(record)
+        if histogram is None:
+            histogram = self.decodeLatency[record] = Histogram()
+        histogram.observe(seconds)
+
+    def update(self, decoder, fields):
+        '''
+        Keep the numeric fields as gauges and the strings (model, firmware, ...) as info labels
+        '''
+        for name, unit, _ in decoder.fields:
+            value = fields.get(name)
+            if value is None:
+                continue
+            if decoder.types.get(name) is str:
+                self.info[name] = value
+            else:
+                self.values[name] = (unit, value)
+
+    def render(self):
+        device = {'device': self.jkbms.tag}
+        frames = self.delegate.frames if self.delegate is not None else None
+        worker = self.delegate.worker if self.delegate is not None else None
+        counters = (
+            ('jkbms_notifications_total', 'BLE notifications received', self.notifications),
+            ('jkbms_bytes_total', 'Bytes received for reassembly', self.bytes),
+            ('jkbms_frames_total', 'Complete frames reassembled', self.frames),
+            ('jkbms_resyncs_total', 'Frame candidates dropped while searching the next SOR', self.resyncs + (frames.resyncs if frames else 0)),
+            ('jkbms_checksum_failures_total', 'Frame candidates without a valid checksum', self.checksumFailures + (frames.checksumFailures if frames else 0)),
+            ('jkbms_buffer_overflows_total', 'Reassembly buffer overflows', self.overflows + (frames.overflows if frames else 0)),
+            ('jkbms_records_dropped_total', 'Records dropped by the queue policy', self.dropped + (worker.dropped if worker else 0)),
+            ('jkbms_connects_total', 'Successful connections', getattr(self.jkbms.transport, 'connects', 0)),
+        )
+        lines = []
+        for name, help, value in counters:
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} counter'.format(name))
+            lines.append('{}{} {}'.format(name, labels(**device), value))
+        lines.append('# HELP jkbms_queue_depth Frames waiting for the record worker')
+        lines.append('# TYPE jkbms_queue_depth gauge')
+        lines.append('jkbms_queue_depth{} {}'.format(labels(**device), worker.depth if worker else 0))
+        connectLatency = getattr(self.jkbms.transport, 'connectLatency', None)
+        if connectLatency is not None:
+            lines.append('# HELP jkbms_connect_latency_seconds Time from the previous disconnect until connected')
+            lines.append('# TYPE jkbms_connect_latency_seconds gauge')
+            lines.append('jkbms_connect_latency_seconds{} {}'.format(labels(**device), connectLatency))
+        lines.append('# HELP jkbms_decode_seconds Record decode latency')
+        lines.append('# TYPE jkbms_decode_seconds histogram')
+        for record, histogram in list(self.decodeLatency.items()):
+            lines.extend(histogram.render('jkbms_decode_seconds', dict(device, record=record)))
+        lines.append('# HELP jkbms_publish_seconds Publish latency per record')
+        lines.append('# TYPE jkbms_publish_seconds histogram')
+        lines.extend(self.publishLatency.render('jkbms_publish_seconds', device))
+        if self.info:
+            lines.append('# HELP jkbms_device_info Static device information')
+            lines.append('# TYPE jkbms_device_info gauge')
+            lines.append('jkbms_device_info{} 1'.format(labels(**device, **self.info)))
+        lines.append('# HELP jkbms_value Latest decoded value')
+        lines.append('# TYPE jkbms_value gauge')
+        for name, (unit, value) in list(self.values.items()):
+            lines.append('jkbms_value{} {}'.format(labels(**device, name=name, unit=unit), value))
+        return lines
+
+
+class MetricsServer:
+    '''
+    HTTP endpoint serving the metrics of all devices in the Prometheus text format on /metrics
+    '''
+
+    def __init__(self, devices, port=9100, address=''):
+        self.devices = devices
+        self.port = port
+        self.address = address
+        self.server = None
+        self.thread = None
+
+    def render(self):
+        lines = []
+        for jk in self.devices:
+            lines.extend(jk.metrics.render())
+        return '\n'.join(self.merge(lines)) + '\n'
+
+    @staticmethod
+    def merge(lines):
+        '''
+        Emit every HELP / TYPE line only once, the sample lines of all devices follow it
+        '''
+        families = {}
+        order = []
+        family = None
+        for line in lines:
+            if line.startswith('# HELP '):
+                family = line.split(' ', 3)[2]
+                if family not in families:
+                    families[family] = [line]
+                    order.append(family)
+            elif line.startswith('# TYPE '):
+                if len(families[family]) == 1:
+                    families[family].append(line)
+            else:
+                families[family].append(line)
+        return [line for family in order for line in families[family]]
+
+    def start(self):
+        # http.server takes longer to import than the rest of the package
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug('Metrics request: ' + format % args)
+
+        self.server = ThreadingHTTPServer((self.address, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='jkbms-metrics', daemon=True)
+        self.thread.start()
+        log.info('Serving metrics on port {}'.format(self.port))
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
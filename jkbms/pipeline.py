@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import logging
+import threading
+from collections import deque
+
+log = logging.getLogger('JKBMS-BT')
+
+DROP_OLDEST = 'drop-oldest'
+COALESCE = 'coalesce'
+BLOCK = 'block'
+POLICIES = (DROP_OLDEST, COALESCE, BLOCK)
+
+
+class RecordWorker:
+    '''
+    Bounded queue and worker thread between frame reassembly and record processing
+    - the BLE receive path only calls submit(), decoding and publishing run on the worker thread
+    - overflow policy 'drop-oldest': a full queue discards its oldest frame
+    - overflow policy 'coalesce': a queued frame is replaced by a newer frame of the same record type
+    - overflow policy 'block': submit() waits for free space (lossless, for offline replay only)
+    '''
+
+    def __str__(self):
+        return 'RecordWorker --- policy: {}, maxsize: {}, depth: {}, queued: {}, dropped: {}, processed: {}, errors: {}'.format(self.policy, self.maxsize, self.depth, self.queued, self.dropped, self.processed, self.errors)
+
+    def __init__(self, process, maxsize=16, policy=DROP_OLDEST, name='jkbms-worker'):
+        if policy not in POLICIES:
+            raise ValueError('Invalid queue policy {}, valid: {}'.format(policy, ', '.join(POLICIES)))
+        self.process = process
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.name = name
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.queued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.errors = 0
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame):
+        '''
+        Queue a complete frame, only blocks with the 'block' policy
+        '''
+        with self.cond:
+            self.queued += 1
+            if self.policy == BLOCK:
+                while self.running and len(self.queue) >= self.maxsize:
+                    self.cond.wait()
+            if self.policy == COALESCE:
+                for i, queuedFrame in enumerate(self.queue):
+                    if queuedFrame[4] == frame[4]:
+                        del self.queue[i]
+                        self.dropped += 1
+                        break
+            if len(self.queue) >= self.maxsize:
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append(frame)
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                frame = self.queue.popleft()
+                if self.policy == BLOCK:
+                    self.cond.notify_all()
+            try:
+                self.process(frame)
+            except Exception:
+                self.errors += 1
+                log.exception('Processing of record failed')
+            self.processed += 1
+
+    def stop(self, drain=True, timeout=10):
+        '''
+        Stop the worker thread, by default after the queued frames are processed
+        '''
+        with self.cond:
+            self.running = False
+            if not drain:
+                self.dropped += len(self.queue)
+                self.queue.clear()
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        log.info(str(self))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import logging
+import re
+import zlib
+
+from .jkbms_mapping import CellArrays, CellCountField, CellStatisticsMapping, DefaultProtocol, InfoIdentityFields, ProtocolLayouts, ProtocolRules
+from .jkbmsdecode import CellDataDecoder, RecordDecoder
+
+log = logging.getLogger('JKBMS-BT')
+
+AUTO = 'auto'
+
+
+class Protocol:
+    '''
+    Frame layout of a BMS model / firmware with its decoders
+    '''
+
+    def __str__(self):
+        return 'Protocol {} - cell data record {} bytes, info record {} bytes'.format(self.name, self.cellInfoDecoder.size, self.infoDecoder.size)
+
+    def __init__(self, name, cellInfoMapping, infoMapping):
+        self.name = name
+        self.cellInfoMapping = cellInfoMapping
+        self.infoMapping = infoMapping
+        self.cellInfoDecoder = CellDataDecoder(cellInfoMapping, CellArrays, CellCountField, CellStatisticsMapping)
+        self.infoDecoder = RecordDecoder(infoMapping)
+        # Info record without the identity fields, used while the identity is unchanged
+        self.infoStatusDecoder = RecordDecoder([entry if entry[2] not in InfoIdentityFields else ("discard",) + tuple(entry[1:]) for entry in infoMapping])
+        self.identityRanges = [(start, stop) for name, _, _, _, start, stop in self.infoDecoder.steps if name in InfoIdentityFields]
+
+    def identityChecksum(self, record):
+        '''
+        CRC32 of the identity bytes of an info record
+        '''
+        view = memoryview(record)
+        checksum = 0
+        for start, stop in self.identityRanges:
+            checksum = zlib.crc32(view[start:stop], checksum)
+        return checksum
+
+
+# Every layout is compiled once at import, decoders are shared by all devices
+PROTOCOLS = {name: Protocol(name, *mappings) for name, mappings in ProtocolLayouts.items()}
+
+
+def firmwareMajor(softwareVersion):
+    '''
+    Major version of a SoftwareVersion string like '11.26' or 'V10.XW', None if there is none
+    '''
+    match = re.search(r'\d+', softwareVersion or '')
+    return int(match.group()) if match else None
+
+
+def normalizeModel(model):
+    '''
+    DeviceModel / configured model in the JK_<hardware> form ('JK-B2A24S' -> 'JK_B2A24S')
+    '''
+    return (model or '').strip().upper().replace('-', '_')
+
+
+def modelCells(model):
+    '''
+    Cell count of a model like 'JK_B2A24S15P' (24), None if the model has none
+    '''
+    match = re.search(r'(\d+)S', normalizeModel(model))
+    return int(match.group(1)) if match else None
+
+
+def getProtocol(name=None):
+    '''
+    Protocol by layout name, None or 'auto' returns the default layout
+    '''
+    if name is None or name == AUTO:
+        name = DefaultProtocol
+    protocol = PROTOCOLS.get(name)
+    if protocol is None:
+        raise ValueError('Invalid protocol {}, valid: {}'.format(name, ', '.join((AUTO,) + tuple(PROTOCOLS))))
+    return protocol
+
+
+def selectProtocol(deviceModel, softwareVersion=None):
+    '''
+    Protocol for the DeviceModel / SoftwareVersion of an info record (first matching rule)
+    - without a SoftwareVersion (configured model) only the model specific rules apply
+    '''
+    model = normalizeModel(deviceModel)
+    cells = modelCells(model) or 0
+    major = firmwareMajor(softwareVersion)
+    for prefix, minCells, minFirmware, name in ProtocolRules:
+        if not model.startswith(prefix) or cells < minCells:
+            continue
+        if major is None:
+            if prefix or minCells:
+                return PROTOCOLS[name]
+        elif major >= minFirmware:
+            return PROTOCOLS[name]
+    return getProtocol()
@@ -1,8 +1,273 @@
 #!/usr/bin/python3
 #
 #
+import logging
+import sys
+import threading
 
-import paho.mqtt.publish as publish
-def publishMqtt(msgData, format='influx2', broker=None, tag=''):
-    return {'topic': tag, 'payload': msgData}
+import json
+from math import gcd
 
+log = logging.getLogger('JKBMS-BT')
+
+TOPICS = 'topics'
+JSON = 'json'
+INFLUX2 = 'influx2'
+FORMATS = (TOPICS, JSON, INFLUX2)
+
+
+def fieldKey(name, unit):
+    if unit:
+        return name + '_' + unit
+    return name
+
+
+def formatValue(value):
+    if type(value) is int:
+        return '{:d}'.format(value)
+    elif type(value) is float:
+        return '{:.3f}'.format(value)
+    return '{}'.format(value)
+
+
+def influxValue(value):
+    if type(value) is int:
+        return '{:d}i'.format(value)
+    elif type(value) is float:
+        return '{:.3f}'.format(value)
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def jsonValue(value):
+    # Same text as json.dumps() of the value rounded like JsonSerializer does
+    if type(value) is float:
+        return repr(round(value, 3))
+    return json.dumps(value)
+
+
+# Value encoders by decoded type, formatValue for fields of unknown type
+TOPIC_ENCODERS = {int: '{:d}'.format, float: '{:.3f}'.format, str: str}
+INFLUX_ENCODERS = {int: '{:d}i'.format, float: '{:.3f}'.format}
+
+
+class PublishPlan:
+    '''
+    Publish plan of one record topic of a device, built once from the published fields
+    - entries: (name, unit, key, encoder) with the topic / key strings and the value encoder precomputed
+    - tick(counter) returns the entries due at a record counter, one precomputed subset per
+      EVERYnTH phase (period: least common multiple of the frequencies)
+    - serialize(values, timestamp) only fills in the [(entry, value)] of a record
+    '''
+
+    def __init__(self, fields, entry):
+        entries = [(name, unit, frequency, entry(name, unit)) for name, unit, frequency in fields]
+        self.period = 1
+        for _, _, frequency, _ in entries:
+            self.period = self.period * frequency // gcd(self.period, frequency)
+        self.ticks = [tuple(planned for _, _, frequency, planned in entries if phase % frequency == 0) for phase in range(self.period)]
+
+    def tick(self, counter):
+        return self.ticks[counter % self.period]
+
+
+class TopicPlan(PublishPlan):
+    def __init__(self, tag, topic, fields, types):
+        prefix = tag + '/' + topic + '/'
+        PublishPlan.__init__(self, fields, lambda name, unit: (name, unit, sys.intern(prefix + fieldKey(name, unit)), TOPIC_ENCODERS.get(types.get(name), formatValue)))
+
+    def serialize(self, values, timestamp):
+        return [{'topic': entry[2], 'payload': entry[3](value)} for entry, value in values]
+
+
+class JsonPlan(PublishPlan):
+    def __init__(self, tag, topic, fields, types):
+        self.topic = sys.intern(tag + '/' + topic)
+        PublishPlan.__init__(self, fields, lambda name, unit: (name, unit, json.dumps(fieldKey(name, unit)) + ':', jsonValue))
+
+    def serialize(self, values, timestamp):
+        if not values:
+            return []
+        payload = '{"timestamp":' + str(timestamp) + ''.join([',' + entry[2] + entry[3](value) for entry, value in values]) + '}'
+        return [{'topic': self.topic, 'payload': payload}]
+
+
+class InfluxPlan(PublishPlan):
+    def __init__(self, tag, topic, fields, types):
+        self.topic = sys.intern(tag + '/' + topic)
+        escapedTag = tag.replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+        self.prefix = '{},device={} '.format(topic, escapedTag)
+        PublishPlan.__init__(self, fields, lambda name, unit: (name, unit, fieldKey(name, unit) + '=', INFLUX_ENCODERS.get(types.get(name), influxValue)))
+
+    def serialize(self, values, timestamp):
+        if not values:
+            return []
+        line = self.prefix + ','.join([entry[2] + entry[3](value) for entry, value in values]) + ' ' + str(timestamp)
+        return [{'topic': self.topic, 'payload': line}]
+
+
+class TopicSerializer:
+    '''
+    One message per field on <tag>/<topic>/<name>_<unit>
+    '''
+
+    def serialize(self, tag, topic, items, timestamp):
+        prefix = tag + '/' + topic + '/'
+        return [{'topic': prefix + fieldKey(name, unit), 'payload': formatValue(value)} for name, unit, value in items]
+
+    def plan(self, tag, topic, fields, types):
+        return TopicPlan(tag, topic, fields, types)
+
+
+class JsonSerializer:
+    '''
+    One compact JSON document per record on <tag>/<topic>
+    - {"timestamp": <ns>, "<name>_<unit>": value, ...}
+    '''
+
+    def serialize(self, tag, topic, items, timestamp):
+        if not items:
+            return []
+        document = {'timestamp': timestamp}
+        for name, unit, value in items:
+            document[fieldKey(name, unit)] = round(value, 3) if type(value) is float else value
+        return [{'topic': tag + '/' + topic, 'payload': json.dumps(document, separators=(',', ':'))}]
+
+    def plan(self, tag, topic, fields, types):
+        return JsonPlan(tag, topic, fields, types)
+
+
+class InfluxSerializer:
+    '''
+    One InfluxDB line protocol line per record on <tag>/<topic>
+    - <topic>,device=<tag> <name>_<unit>=value,... <timestamp ns>
+    '''
+
+    def serialize(self, tag, topic, items, timestamp):
+        fields = [fieldKey(name, unit) + '=' + influxValue(value) for name, unit, value in items]
+        if not fields:
+            return []
+        escapedTag = tag.replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+        line = '{},device={} {} {:d}'.format(topic, escapedTag, ','.join(fields), timestamp)
+        return [{'topic': tag + '/' + topic, 'payload': line}]
+
+    def plan(self, tag, topic, fields, types):
+        return InfluxPlan(tag, topic, fields, types)
+
+
+def createSerializer(format=None):
+    '''
+    Create the serializer for the format of a config section (default: one topic per field)
+    '''
+    if format is None or format == TOPICS:
+        return TopicSerializer()
+    if format == JSON:
+        return JsonSerializer()
+    if format == INFLUX2:
+        return InfluxSerializer()
+    raise ValueError('Invalid format {}, valid: {}'.format(format, ', '.join(FORMATS)))
+
+
+class StreamPublisher:
+    '''
+    Writes messages as '<topic> <payload>' lines to a stream instead of publishing them
+    - used to print results only and for offline replay
+    '''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def multiple(self, msgs):
+        lines = ''.join(['{} {}\n'.format(msg['topic'], msg.get('payload')) for msg in msgs])
+        with self.lock:
+            self.stream.write(lines)
+
+    def close(self):
+        self.stream.flush()
+
+
+class MqttPublisher:
+    '''
+    Long lived MQTT connection to one broker, shared by all JKBMS sections
+    - publishes are handed to the paho network thread (no connect/disconnect per record)
+    - paho reconnects with exponential backoff between minReconnectDelay and maxReconnectDelay
+    - connect() waits up to connectTimeout for the CONNACK, paho drops QoS 0 publishes before it
+    - QoS 1/2 messages published while disconnected are kept by paho (at most maxQueued) and sent
+      after the reconnect, they count as handed over
+    '''
+
+    def __str__(self):
+        return 'MqttPublisher --- broker: {}, port: {}, qos: {}, keepalive: {}, connected: {}'.format(self.broker, self.port, self.qos, self.keepalive, self.connected)
+
+    def __init__(self, broker, port=1883, qos=0, keepalive=60, minReconnectDelay=1, maxReconnectDelay=120, clientId='', connectTimeout=10, maxQueued=1000):
+        self.broker = broker
+        self.port = port
+        self.qos = qos
+        self.keepalive = keepalive
+        self.connectTimeout = connectTimeout
+        self.connected = False
+        self.connectedEvent = threading.Event()
+        self.published = 0
+        self.failed = 0
+        # Imported here, printing, decoding and replay work without paho installed
+        import paho.mqtt.client as mqtt
+
+        self.mqtt = mqtt
+        try:
+            # paho-mqtt >= 2.0
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=clientId)
+        except AttributeError:
+            self.client = mqtt.Client(client_id=clientId)
+        self.client.on_connect = self.onConnect
+        self.client.on_disconnect = self.onDisconnect
+        self.client.reconnect_delay_set(min_delay=minReconnectDelay, max_delay=maxReconnectDelay)
+        # Bounds the QoS 1/2 messages paho keeps during an outage (0: unlimited)
+        self.client.max_queued_messages_set(maxQueued)
+
+    def onConnect(self, client, userdata, flags, rc, *args):
+        log.info('MQTT connected to {}:{} ({})'.format(self.broker, self.port, rc))
+        self.connected = True
+        self.connectedEvent.set()
+
+    def onDisconnect(self, client, userdata, *args):
+        log.warning('MQTT disconnected from {}:{}'.format(self.broker, self.port))
+        self.connected = False
+        self.connectedEvent.clear()
+
+    def connect(self):
+        '''
+        Start the network thread, the connection is (re)established in the background
+        - waits up to connectTimeout seconds for the first connection, so the first records are not
+          dropped while the CONNACK is outstanding
+        '''
+        log.info('MQTT connecting to {}:{}'.format(self.broker, self.port))
+        self.client.connect_async(self.broker, self.port, self.keepalive)
+        self.client.loop_start()
+        if not self.connectedEvent.wait(self.connectTimeout):
+            log.warning('MQTT not connected to {}:{} after {}s, continuing in the background'.format(self.broker, self.port, self.connectTimeout))
+
+    def multiple(self, msgs):
+        '''
+        Publish a list of {'topic': ..., 'payload': ..., 'qos': ..., 'retain': ...} messages
+        - same message format as paho.mqtt.publish.multiple
+        - stops at the first message that cannot be handed to the connection (keeps the order)
+        - returns the number of messages handed over, msgs[sent:] were not published
+        '''
+        for sent, msg in enumerate(msgs):
+            qos = msg.get('qos', self.qos)
+            info = self.client.publish(msg['topic'], msg.get('payload'), qos, msg.get('retain', False))
+            # Without a connection paho still queues QoS 1/2 messages and resends them after the reconnect
+            if info.rc != self.mqtt.MQTT_ERR_SUCCESS and not (qos and info.rc == self.mqtt.MQTT_ERR_NO_CONN):
+                self.failed += len(msgs) - sent
+                log.debug('MQTT publish to {} failed: {}'.format(msg['topic'], self.mqtt.error_string(info.rc)))
+                return sent
+            self.published += 1
+        return len(msgs)
+
+    def close(self):
+        '''
+        Flush queued messages and stop the network thread
+        '''
+        log.info('MQTT closing connection to {}:{}'.format(self.broker, self.port))
+        self.client.disconnect()
+        self.client.loop_stop()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import logging
+import sys
+import time
+
+from .framebuffer import FrameBuffer
+from .jkbms import CELL_DATA, INFO_RECORD, cellInfoDecoder, infoDecoder, jkBMS, jkBmsDelegate
+from .pipeline import BLOCK
+from .publishMqtt import StreamPublisher
+
+log = logging.getLogger('JKBMS-BT')
+
+CAPTURE_FORMATS = ('auto', 'hex', 'raw', 'timestamped')
+# Raw captures are fed in notification sized chunks (MTU 330)
+RAW_CHUNK_SIZE = 327
+
+
+def parseHex(text):
+    '''
+    Parse a hex string, separators (spaces, colons, 0x prefixes) are ignored
+    '''
+    text = text.replace('0x', '').replace(':', '').replace(' ', '').replace('\t', '')
+    return bytes.fromhex(text)
+
+
+def detectFormat(path):
+    with open(path, 'rb') as f:
+        sample = f.read(4096)
+    try:
+        lines = [line.strip() for line in sample.decode('ascii').splitlines() if line.strip() and not line.startswith('#')]
+    except UnicodeDecodeError:
+        return 'raw'
+    if not lines:
+        return 'hex'
+    fields = lines[0].split()
+    if len(fields) == 2:
+        try:
+            float(fields[0])
+            return 'timestamped'
+        except ValueError:
+            pass
+    try:
+        parseHex(lines[0])
+        return 'hex'
+    except ValueError:
+        return 'raw'
+
+
+def readCapture(path, format='auto'):
+    '''
+    Yield the notifications of a captured BLE stream
+    - hex: one notification per line as hex
+    - raw: binary stream, fed in notification sized chunks
+    - timestamped: '<timestamp> <hex>' per line, the timestamp is ignored (replay runs at full speed)
+    Empty lines and lines starting with # are skipped
+    '''
+    if format == 'auto':
+        format = detectFormat(path)
+        log.info('Capture {} detected as {}'.format(path, format))
+    if format == 'raw':
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(RAW_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if format == 'timestamped':
+                line = line.split(None, 1)[1] if ' ' in line or '\t' in line else ''
+            yield parseHex(line)
+
+
+def decodeHex(hexString):
+    '''
+    Decode the records contained in a hex string, returns a list of dicts of name: value
+    '''
+    frames = FrameBuffer(capacity=max(1024, len(hexString)))
+    frames.append(parseHex(hexString))
+    results = []
+    frame = frames.frame()
+    while frame is not None:
+        if frame[4] == CELL_DATA:
+            results.append(cellInfoDecoder.decode(frame))
+        elif frame[4] == INFO_RECORD:
+            results.append(infoDecoder.decode(frame))
+        frame = frames.frame()
+    return results
+
+
+def replay(paths, format='auto', output=None, tag='Replay'):
+    '''
+    Feed captured notifications through the reassembly, decode and publish path as fast as possible
+    - decoded messages are written as '<topic> <payload>' lines to output (default stdout)
+    - returns (frames, seconds)
+    '''
+    stream = sys.stdout if output is None else open(output, 'w')
+    try:
+        # No record limit, every record of the capture is decoded
+        jk = jkBMS(name='replay', model=None, mac=None, command=None, tag=tag, format=None, records=sys.maxsize, publisher=StreamPublisher(stream), queuePolicy=BLOCK)
+        delegate = jkBmsDelegate(jk)
+        notifications = 0
+        start = time.perf_counter()
+        delegate.worker.start()
+        try:
+            for path in paths:
+                for data in readCapture(path, format):
+                    notifications += 1
+                    delegate.handleNotification(0, data)
+        finally:
+            delegate.worker.stop()
+        seconds = time.perf_counter() - start
+    finally:
+        if output is not None:
+            stream.close()
+    frames = delegate.worker.processed
+    print('Replayed {} notifications, {} frames in {:.3f}s ({:.1f} frames/s)'.format(notifications, frames, seconds, frames / seconds if seconds else 0), file=sys.stderr)
+    return frames, seconds
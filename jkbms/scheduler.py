@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+import logging
+import time
+
+log = logging.getLogger('JKBMS-BT')
+
+
+class Command:
+    '''
+    Request written to the BMS and the record type answering it
+    - priority: lower values are sent first when several commands are due
+    - timeout: seconds to wait for the answer, the command is retried up to retries times
+    - interval: re-issue the command every interval seconds within a session (0: once)
+    - stream: the BMS keeps sending records after the command (cell data), it is re-issued when
+      no record arrived for streamTimeout seconds
+    '''
+
+    def __str__(self):
+        return 'Command {} --- record type: {}, priority: {}, timeout: {}s, interval: {}s'.format(self.name, self.recordType, self.priority, self.timeout, self.interval)
+
+    def __init__(self, name, payload, recordType, priority=0, timeout=5.0, retries=2, interval=0, stream=False, streamTimeout=10.0):
+        self.name = name
+        self.payload = payload
+        self.recordType = recordType
+        self.priority = priority
+        self.timeout = timeout
+        self.retries = retries
+        self.interval = interval
+        self.stream = stream
+        self.streamTimeout = streamTimeout
+
+
+class CommandScheduler:
+    '''
+    Sends the commands of a session one at a time and advances as soon as the answer is complete
+    - an answer is complete when the delegate reassembled a frame of the command's record type
+    - runs on the thread that waits for notifications, no locking needed
+    - the delegate accepts the record types of all commands sent in the session, so streamed
+      cell data keeps flowing while a periodic command is answered
+    - run() drives a blocking transport, event loops call start() and step() themselves and
+      write the returned commands
+    '''
+
+    def __init__(self, transport, delegate, commands):
+        self.transport = transport
+        self.delegate = delegate
+        self.commands = commands
+        # (due time, priority, sequence, command, attempt)
+        self.queue = []
+        self.sequence = 0
+        self.active = None
+        self.deadline = 0
+        self.baseline = 0
+        self.attempt = 0
+        self.ready = False
+        # record type: (command, frames received when last checked, time of the last frame)
+        self.streams = {}
+        self.sent = 0
+        self.timeouts = 0
+
+    def schedule(self, command, due, attempt=0):
+        self.sequence += 1
+        self.queue.append((due, command.priority, self.sequence, command, attempt))
+
+    def nextDue(self, now):
+        '''
+        Pop the highest priority command that is due at now, None if there is none
+        '''
+        due = [entry for entry in self.queue if entry[0] <= now]
+        if not due:
+            return None
+        entry = min(due, key=lambda entry: (entry[1], entry[2]))
+        self.queue.remove(entry)
+        return entry
+
+    def send(self, command, attempt, now):
+        self.delegate.record_types = self.delegate.record_types | {command.recordType}
+        self.active = command
+        self.attempt = attempt
+        self.deadline = now + command.timeout
+        self.baseline = self.delegate.received[command.recordType]
+        self.sent += 1
+
+    def complete(self, now):
+        command = self.active
+        self.active = None
+        if command.stream:
+            self.streams[command.recordType] = (command, self.delegate.received[command.recordType], now)
+        if command.interval:
+            self.schedule(command, now + command.interval)
+
+    def checkActive(self, now):
+        if self.delegate.received[self.active.recordType] > self.baseline:
+            log.debug('{} answered'.format(self.active.name))
+            self.complete(now)
+        elif now >= self.deadline:
+            command = self.active
+            self.active = None
+            self.timeouts += 1
+            if self.attempt < command.retries:
+                log.info('{} timed out after {}s, retrying'.format(command.name, command.timeout))
+                self.schedule(command, now, self.attempt + 1)
+            else:
+                log.warning('{} not answered after {} attempts'.format(command.name, self.attempt + 1))
+                if command.interval:
+                    self.schedule(command, now + command.interval)
+
+    def checkStreams(self, now):
+        for recordType, (command, received, last) in list(self.streams.items()):
+            count = self.delegate.received[recordType]
+            if count != received:
+                self.streams[recordType] = (command, count, now)
+            elif now - last >= command.streamTimeout:
+                log.info('No answer to {} for {}s, re-issuing it'.format(command.name, command.streamTimeout))
+                del self.streams[recordType]
+                self.schedule(command, now)
+
+    def start(self, now=None):
+        '''
+        Queue the commands of the session (due at now), only their answers are accepted from now on
+        '''
+        self.delegate.record_types = frozenset()
+        if now is None:
+            now = time.monotonic()
+        for command in self.commands:
+            self.schedule(command, now)
+
+    def step(self, now, onReady=None, poll=1.0):
+        '''
+        Advance the schedule to now
+        - returns the command to write now (or None) and the seconds until the next step is needed
+        - onReady is called once, when every command queued at the start was answered (or gave up)
+        '''
+        command = None
+        if self.active is not None:
+            self.checkActive(now)
+        self.checkStreams(now)
+        if self.active is None:
+            entry = self.nextDue(now)
+            if entry is not None:
+                command = entry[3]
+                self.send(command, entry[4], now)
+            elif not self.ready:
+                # Only periodic commands left (due later)
+                self.ready = True
+                if onReady is not None:
+                    onReady()
+        timeout = poll
+        if self.active is not None:
+            timeout = min(poll, max(self.deadline - now, 0.01))
+        elif self.queue:
+            timeout = min(poll, max(min(entry[0] for entry in self.queue) - now, 0.01))
+        return command, timeout
+
+    def run(self, done, onReady=None, poll=1.0):
+        '''
+        Process the commands on a blocking transport until done() returns True
+        '''
+        self.start()
+        while True:
+            command, timeout = self.step(time.monotonic(), onReady, poll)
+            if command is not None:
+                log.info('Write {} (attempt {}): {}'.format(command.name, self.attempt + 1, self.transport.write(command.payload)))
+            if self.ready and done():
+                return
+            self.transport.waitForNotifications(timeout)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from struct import Struct
+
+log = logging.getLogger('JKBMS-BT')
+
+SEGMENT_SUFFIX = '.seg'
+
+
+class Segment:
+    '''
+    Memory-mapped, preallocated append-only segment file
+    - header: offset of the first unconsumed record
+    - records: payload length, timestamp ns, payload
+    '''
+    header = Struct('<Q')
+    record = Struct('<IQ')
+
+    def __init__(self, path, size=None):
+        self.path = path
+        create = size is not None
+        self.file = open(path, 'w+b' if create else 'r+b')
+        if create:
+            self.file.truncate(size)
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        self.readOffset = self.header.unpack_from(self.map)[0] or self.header.size
+        # Find the end of the written records
+        self.writeOffset = self.readOffset
+        while self.writeOffset + self.record.size <= self.size:
+            length = self.record.unpack_from(self.map, self.writeOffset)[0]
+            if length == 0 or self.writeOffset + self.record.size + length > self.size:
+                break
+            self.writeOffset += self.record.size + length
+
+    @property
+    def created(self):
+        return int(os.path.basename(self.path)[:-len(SEGMENT_SUFFIX)]) / 1e9
+
+    @property
+    def empty(self):
+        return self.readOffset >= self.writeOffset
+
+    def append(self, payload, timestamp):
+        end = self.writeOffset + self.record.size + len(payload)
+        if end > self.size:
+            return False
+        self.map[self.writeOffset + self.record.size:end] = payload
+        # Length is written last, a torn write leaves a zero length end marker
+        self.record.pack_into(self.map, self.writeOffset, len(payload), timestamp)
+        self.writeOffset = end
+        return True
+
+    def peek(self):
+        '''
+        Return (payload, timestamp, next offset) of the oldest unconsumed record
+        '''
+        length, timestamp = self.record.unpack_from(self.map, self.readOffset)
+        start = self.readOffset + self.record.size
+        return self.map[start:start + length], timestamp, start + length
+
+    def commit(self, offset):
+        self.readOffset = offset
+        self.header.pack_into(self.map, 0, offset)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def delete(self):
+        self.close()
+        os.remove(self.path)
+
+
+class Spool:
+    '''
+    Disk-backed append-only spool of message batches
+    - segments of segmentSize bytes, memory-mapped
+    - oldest segments are evicted when the spool exceeds maxBytes or a segment is older than maxAge seconds
+    - survives restarts, existing segments in directory are picked up again
+    '''
+
+    def __init__(self, directory, segmentSize=1 << 20, maxBytes=64 << 20, maxAge=7 * 24 * 3600):
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        self.evicted = 0
+        os.makedirs(directory, exist_ok=True)
+        self.segments = [
+            Segment(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory), key=lambda name: int(name[:-len(SEGMENT_SUFFIX)]))
+            if name.endswith(SEGMENT_SUFFIX)
+        ]
+        if self.segments:
+            log.info('Spool {} holds {} segments from a previous run'.format(directory, len(self.segments)))
+
+    @property
+    def empty(self):
+        return all(segment.empty for segment in self.segments)
+
+    def append(self, msgs):
+        payload = json.dumps(msgs, separators=(',', ':')).encode()
+        timestamp = time.time_ns()
+        with self.lock:
+            if not self.segments or not self.segments[-1].append(payload, timestamp):
+                size = max(self.segmentSize, Segment.header.size + Segment.record.size + len(payload))
+                self.segments.append(Segment(os.path.join(self.directory, '{:d}{}'.format(timestamp, SEGMENT_SUFFIX)), size))
+                self.segments[-1].append(payload, timestamp)
+            self.evict()
+
+    def evict(self):
+        now = time.time()
+        while len(self.segments) > 1 and (
+            sum(segment.size for segment in self.segments) > self.maxBytes or now - self.segments[0].created > self.maxAge
+        ):
+            log.warning('Spool full or expired, dropping segment {}'.format(self.segments[0].path))
+            self.segments.pop(0).delete()
+            self.evicted += 1
+
+    def peek(self):
+        '''
+        Return (msgs, token) of the oldest spooled batch or None, pass token to commit() once published
+        '''
+        with self.lock:
+            while self.segments:
+                segment = self.segments[0]
+                if not segment.empty:
+                    payload, _, offset = segment.peek()
+                    return json.loads(payload), (segment, offset)
+                if len(self.segments) == 1:
+                    return None
+                self.segments.pop(0).delete()
+            return None
+
+    def commit(self, token):
+        '''
+        Mark the batch of token as published, False if its segment was evicted meanwhile
+        '''
+        segment, offset = token
+        with self.lock:
+            if segment not in self.segments:
+                return False
+            segment.commit(offset)
+            return True
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments:
+                if segment.empty:
+                    segment.delete()
+                else:
+                    segment.close()
+            self.segments = []
+
+
+class SpoolingPublisher:
+    '''
+    Publisher wrapper that spools messages to disk while the broker is unreachable
+    - never raises into the record processing path
+    - drains the spool in order at up to drainRate messages per second once the broker is back
+    - only the messages the publisher did not hand over are spooled or resent (no duplicates of
+      partly published batches), publishers without a count (None) have sent everything
+    '''
+
+    def __init__(self, publisher, spool, drainRate=500):
+        self.publisher = publisher
+        self.spool = spool
+        self.drainRate = drainRate
+        self.spooled = 0
+        self.drained = 0
+        self.stopEvent = threading.Event()
+        self.thread = None
+        # (unsent messages, token) of a partly drained batch, committed once the rest is sent
+        self.pending = None
+
+    @property
+    def connected(self):
+        return getattr(self.publisher, 'connected', True)
+
+    def connect(self):
+        self.publisher.connect()
+        self.thread = threading.Thread(target=self.drain, name='jkbms-spool', daemon=True)
+        self.thread.start()
+
+    def multiple(self, msgs):
+        # Once anything is spooled new messages queue up behind it to keep the order
+        if self.connected and self.spool.empty and self.pending is None:
+            try:
+                sent = self.publisher.multiple(msgs)
+                if sent is None or sent == len(msgs):
+                    return True
+                msgs = msgs[sent:]
+            except Exception:
+                log.exception('Publishing failed, spooling messages')
+        self.spool.append(msgs)
+        self.spooled += len(msgs)
+        return True
+
+    def drain(self):
+        while not self.stopEvent.wait(1.0):
+            started = time.monotonic()
+            sent = 0
+            while self.connected and not self.stopEvent.is_set():
+                batch = self.pending or self.spool.peek()
+                if batch is None:
+                    break
+                msgs, token = batch
+                try:
+                    count = self.publisher.multiple(msgs)
+                    if count is None:
+                        count = len(msgs)
+                    self.drained += count
+                    sent += count
+                    if count < len(msgs):
+                        self.pending = (msgs[count:], token)
+                        break
+                    self.pending = None
+                    if not self.spool.commit(token):
+                        log.info('Spool segment evicted while draining it, continuing with the next one')
+                except Exception:
+                    log.exception('Draining spool failed')
+                    break
+                # Rate limit: sleep until the messages sent so far fit drainRate
+                delay = sent / self.drainRate - (time.monotonic() - started)
+                if delay > 0:
+                    self.stopEvent.wait(delay)
+
+    def close(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.publisher.close()
+        self.spool.close()
+        log.info('Spool: {} messages spooled, {} drained, {} segments evicted'.format(self.spooled, self.drained, self.spool.evicted))
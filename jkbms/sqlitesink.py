@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .publishMqtt import fieldKey
+
+log = logging.getLogger('JKBMS-BT')
+
+SQL_TYPES = {int: 'INTEGER', float: 'REAL', str: 'TEXT'}
+RETENTION_CHECK_INTERVAL = 3600
+
+
+class SqliteSink:
+    '''
+    Stores decoded records in a local SQLite database (WAL mode)
+    - one table per record type, one row per record and one column per field of the record decoders
+    - every decoder (layout) writing to a table adds its missing columns, so devices with different
+      layouts share a table
+    - rows are inserted in batches of batchSize rows or at least every flushInterval seconds, a
+      background thread flushes the queued rows of devices that stopped sending records
+    - rows older than retentionDays days are deleted (0 keeps everything)
+    '''
+
+    def __init__(self, path, batchSize=60, flushInterval=10, retentionDays=30):
+        self.path = path
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.retentionDays = retentionDays
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        # (table, decoder): (insert statement, [field names in column order])
+        self.tables = {}
+        # (table, decoder): [rows]
+        self.pending = {}
+        self.lastFlush = time.monotonic()
+        self.lastRetention = 0
+        self.written = 0
+        self.stopEvent = threading.Event()
+        self.thread = None
+        if flushInterval > 0:
+            self.thread = threading.Thread(target=self.run, name='jkbms-sqlite', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopEvent.wait(self.flushInterval):
+            with self.lock:
+                if time.monotonic() - self.lastFlush >= self.flushInterval:
+                    self.flush()
+
+    def createTable(self, table, decoder):
+        '''
+        Create (or extend) table with one column per field of decoder and prepare its insert statement
+        '''
+        columns = [(name, fieldKey(name, unit), SQL_TYPES[decoder.types[name]]) for name, unit, _ in decoder.fields]
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS "{}" (timestamp REAL NOT NULL, device TEXT NOT NULL)'.format(table))
+            self.connection.execute('CREATE INDEX IF NOT EXISTS "{0}_device_timestamp" ON "{0}" (device, timestamp)'.format(table))
+            existing = {row[1] for row in self.connection.execute('PRAGMA table_info("{}")'.format(table))}
+            for _, column, sqlType in columns:
+                if column not in existing:
+                    self.connection.execute('ALTER TABLE "{}" ADD COLUMN "{}" {}'.format(table, column, sqlType))
+        statement = 'INSERT INTO "{}" (timestamp, device, {}) VALUES (?, ?, {})'.format(
+            table, ', '.join('"{}"'.format(column) for _, column, _ in columns), ', '.join('?' * len(columns)))
+        self.tables[table, decoder] = (statement, [name for name, _, _ in columns])
+        self.pending[table, decoder] = []
+
+    def write(self, device, table, decoder, fields, timestamp):
+        '''
+        Queue one decoded record (fields dict of decoder) as row of table
+        '''
+        with self.lock:
+            key = (table, decoder)
+            if key not in self.tables:
+                self.createTable(table, decoder)
+            names = self.tables[key][1]
+            self.pending[key].append([timestamp, device] + [fields.get(name) for name in names])
+            if len(self.pending[key]) >= self.batchSize or time.monotonic() - self.lastFlush >= self.flushInterval:
+                self.flush()
+
+    def flush(self):
+        '''
+        Insert all queued rows in one transaction, caller holds the lock
+        '''
+        with self.connection:
+            for key, rows in self.pending.items():
+                if rows:
+                    self.connection.executemany(self.tables[key][0], rows)
+                    self.written += len(rows)
+                    self.pending[key] = []
+        self.lastFlush = time.monotonic()
+        if self.retentionDays and self.lastFlush - self.lastRetention >= RETENTION_CHECK_INTERVAL:
+            self.lastRetention = self.lastFlush
+            self.expire()
+
+    def expire(self):
+        cutoff = time.time() - self.retentionDays * 24 * 3600
+        with self.connection:
+            for table in {table for table, _ in self.tables}:
+                deleted = self.connection.execute('DELETE FROM "{}" WHERE timestamp < ?'.format(table), (cutoff,)).rowcount
+                if deleted:
+                    log.info('Deleted {} rows older than {} days from {}'.format(deleted, self.retentionDays, table))
+
+    def close(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self.flush()
+            self.connection.close()
+        log.info('SQLite sink {}: {} rows written'.format(self.path, self.written))
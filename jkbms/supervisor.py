@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import logging
+import os
+import threading
+import time
+
+from .jkbms import systemdNotify
+from .transport import Backoff
+
+log = logging.getLogger('JKBMS-BT')
+
+
+class Supervisor:
+    '''
+    Runs every configured JKBMS section concurrently, one thread per device
+    - all devices share the publisher they were created with
+    - in daemon mode each device session is restarted independently when it ends or fails, failed
+      sessions after an exponential backoff that is reset once a session received records
+    '''
+
+    def __init__(self, devices, daemon=False, backoff=None):
+        self.devices = devices
+        self.isDaemon = daemon
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.stopEvent = threading.Event()
+        self.threads = []
+
+    def start(self):
+        names = set()
+        for jk in self.devices:
+            # Thread names identify the device in logs and dumps, keep them unique
+            name = 'jkbms-{}'.format(jk.name)
+            suffix = 1
+            while name in names:
+                suffix += 1
+                name = 'jkbms-{}-{}'.format(jk.name, suffix)
+            names.add(name)
+            thread = threading.Thread(target=self.runDevice, args=(jk,), name=name, daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def runDevice(self, jk):
+        sessions = 0
+        retries = 0
+        while not self.stopEvent.is_set():
+            sessions += 1
+            failed = False
+            try:
+                if jk.connect():
+                    try:
+                        jk.getBLEData()
+                    finally:
+                        jk.disconnect()
+                else:
+                    failed = True
+                    log.warning('Failed to connect to {} {}'.format(jk.name, jk.mac))
+            except Exception:
+                failed = True
+                log.exception('Session {} of {} failed'.format(sessions, jk.name))
+            if not self.isDaemon:
+                break
+            if jk.delegate is not None and jk.delegate.record_counter:
+                retries = 0
+            if failed:
+                delay = self.backoff.delay(retries)
+                retries += 1
+                log.info('Restarting {} in {:.1f}s'.format(jk.name, delay))
+                self.stopEvent.wait(delay)
+
+    def join(self):
+        # Join with a timeout so KeyboardInterrupt is still delivered to the main thread
+        for thread in self.threads:
+            while thread.is_alive():
+                thread.join(1.0)
+
+    def stop(self):
+        self.stopEvent.set()
+
+
+class Watchdog:
+    '''
+    Pings the systemd watchdog while the process still reads its devices
+    - each device updates jk.heartbeat per record, devices without records for maxAge seconds are
+      logged, their sessions are restarted by the supervisor, not the whole service
+    - pings stop (systemd restarts the service) when a supervisor thread died or no device at all
+      delivered records for maxAge seconds
+    - maxAge defaults to the WatchdogSec of the unit (WATCHDOG_USEC), pings every maxAge / 2
+    '''
+
+    def __init__(self, devices, threads=(), maxAge=None):
+        self.devices = devices
+        self.threads = threads
+        if maxAge is None:
+            maxAge = int(os.environ.get('WATCHDOG_USEC', 60 * 1000000)) / 1000000
+        self.maxAge = maxAge
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def stale(self, now=None):
+        '''
+        Devices without a record for more than maxAge seconds
+        '''
+        if now is None:
+            now = time.monotonic()
+        return [jk for jk in self.devices if now - jk.heartbeat > self.maxAge]
+
+    def healthy(self, now=None):
+        '''
+        True while every supervisor thread runs and at least one device delivers records
+        '''
+        stale = self.stale(now)
+        if stale:
+            log.warning('No records from {} for {}s'.format(', '.join([jk.name for jk in stale]), self.maxAge))
+        dead = [thread.name for thread in self.threads if not thread.is_alive()]
+        if dead:
+            log.error('Threads {} ended, not pinging the watchdog'.format(', '.join(dead)))
+            return False
+        return len(stale) < len(self.devices)
+
+    def run(self):
+        while not self.stopEvent.wait(self.maxAge / 2):
+            if self.healthy():
+                systemdNotify('WATCHDOG=1')
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='jkbms-watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
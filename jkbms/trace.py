@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import signal
+import sys
+import time
+from collections import deque
+
+NOTIFICATION = 'rx'
+FRAME = 'frame'
+
+
+class FrameTrace:
+    '''
+    Ring buffer of sampled raw notifications and frames for debugging without debug logging
+    - only references to the (immutable) data are kept, hex formatting happens in dump()
+    - every sample-th notification is kept, frames are always kept
+    '''
+
+    def __init__(self, name, size=256, sample=1):
+        self.name = name
+        self.entries = deque(maxlen=size)
+        self.sample = max(1, int(sample))
+        self.skipped = 0
+
+    def notification(self, data):
+        self.skipped += 1
+        if self.skipped >= self.sample:
+            self.skipped = 0
+            self.entries.append((time.time(), NOTIFICATION, bytes(data)))
+
+    def frame(self, frame):
+        self.entries.append((time.time(), FRAME, frame))
+
+    def dump(self, write):
+        entries = list(self.entries)
+        write('Trace {}: {} entries (1/{} notifications sampled)'.format(self.name, len(entries), self.sample))
+        for timestamp, kind, data in entries:
+            write('{:.3f} {} {} {}'.format(timestamp, self.name, kind, data.hex()))
+
+
+def installDumpHandler(devices, signum=getattr(signal, 'SIGUSR1', None)):
+    '''
+    Dump the frame traces of all devices to stderr on signum (SIGUSR1, not on Windows)
+    - independent of the logging level, which is usually too high in production to show traces
+    '''
+    if signum is None:
+        return
+
+    def write(line):
+        print(line, file=sys.stderr)
+
+    def dump(received, stack):
+        for jk in devices:
+            if jk.trace is not None:
+                jk.trace.dump(write)
+        sys.stderr.flush()
+
+    signal.signal(signum, dump)
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+import logging
+import math
+import random
+import struct
+import time
+
+from .framebuffer import SOR
+from .protocol import selectProtocol
+from .jkbmsdecode import DATA_ASCII, crc8
+
+log = logging.getLogger('JKBMS-BT')
+
+BLE = 'ble'
+SERIAL = 'serial'
+SIMULATED = 'sim'
+TRANSPORTS = (BLE, SERIAL, SIMULATED)
+
+# Request record types as sent in the getInfo / getCellInfo commands
+COMMAND_TYPE_OFFSET = 4
+REQUEST_CELL_DATA = 0x96
+REQUEST_INFO = 0x97
+
+# Notify service / characteristic of the BMS and the client characteristic configuration descriptor
+SERVICE_NOTIFY_UUID = 'ffe0'
+CHARACTERISTIC_READ_UUID = 'ffe1' # Grypho: Adopted to newer BMS systems
+CCCD_UUID = 0x2902
+# Notification enable handle of the JK-B2A* firmware, used when the descriptor is not reported
+DEFAULT_NOTIFY_HANDLE = 0x0b
+
+
+def createTransport(jkbms, transport=BLE, **options):
+    '''
+    Create the transport named transport for the jkBMS instance jkbms
+    '''
+    if transport == BLE:
+        return BleTransport(jkbms, **options)
+    if transport == SERIAL:
+        return SerialTransport(jkbms, **options)
+    if transport == SIMULATED:
+        return SimulatedTransport(jkbms, **options)
+    raise ValueError('Invalid transport {}, valid: {}'.format(transport, ', '.join(TRANSPORTS)))
+
+
+class Backoff:
+    '''
+    Exponential backoff with jitter for connection retries
+    - the delay of retry n is drawn from [d/2, d] with d = minDelay * 2^n capped at maxDelay
+    '''
+
+    def __init__(self, minDelay=0.5, maxDelay=30.0):
+        self.minDelay = minDelay
+        self.maxDelay = maxDelay
+
+    def delay(self, retry):
+        delay = min(self.maxDelay, self.minDelay * (2 ** retry))
+        return random.uniform(delay / 2, delay)
+
+
+class BleTransport:
+    '''
+    Bluetooth LE transport using bluepy
+    - handles are taken from the handle cache when possible, discovery only runs on a miss
+    - failed connection attempts are retried with exponential backoff
+    - connectLatency: seconds from the first attempt (or the previous disconnect) until connected
+    '''
+
+    def __init__(self, jkbms, handleCache=None, minDelay=0.5, maxDelay=30.0):
+        self.jkbms = jkbms
+        self.handleCache = handleCache
+        self.backoff = Backoff(minDelay, maxDelay)
+        self.device = None
+        self.handleRead = None
+        self.handleNotify = None
+        self.disconnectedAt = None
+        self.connectLatency = None
+        self.connects = 0
+
+    def connect(self, delegate):
+        from bluepy import btle
+
+        # A reconnect is measured from the end of the previous session
+        started = self.disconnectedAt if self.disconnectedAt is not None else time.monotonic()
+        # Intialise BLE device
+        self.device = btle.Peripheral(None, iface=self.jkbms.adapter)
+        self.device.withDelegate(delegate)
+        # Connect to BLE Device
+        log.info('Attempting to connect to {}'.format(self.jkbms.name))
+        for attempt in range(self.jkbms.maxConnectionAttempts):
+            if attempt:
+                delay = self.backoff.delay(attempt - 1)
+                log.info('Retrying {} in {:.1f}s'.format(self.jkbms.name, delay))
+                time.sleep(delay)
+            try:
+                self.device.connect(self.jkbms.mac, iface=self.jkbms.adapter)
+                self.device.setMTU(330)
+            except Exception as e:
+                log.info('Connection attempt {} to {} failed: {}'.format(attempt + 1, self.jkbms.name, e))
+                continue
+            self.connects += 1
+            self.connectLatency = time.monotonic() - started
+            self.disconnectedAt = None
+            log.info('Connected to {} after {} attempts in {:.2f}s'.format(self.jkbms.name, attempt + 1, self.connectLatency))
+            self.jkbms.publishLink([('ConnectLatency', 's', self.connectLatency), ('ConnectAttempts', '', attempt + 1)])
+            return True
+        log.warning('Cannot connect to {} with mac {} - exceeded {} attempts'.format(self.jkbms.name, self.jkbms.mac, self.jkbms.maxConnectionAttempts))
+        return False
+
+    def discover(self):
+        '''
+        Find the read characteristic and its notification descriptor via service discovery
+        '''
+        from bluepy import btle
+
+        # Get the device name
+        serviceId = self.device.getServiceByUUID(btle.AssignedNumbers.genericAccess)
+        deviceName = serviceId.getCharacteristics(btle.AssignedNumbers.deviceName)[0]
+        log.info('Connected to {}'.format(deviceName.read()))
+
+        # Connect to the notify service
+        serviceNotify = self.device.getServiceByUUID(SERVICE_NOTIFY_UUID)
+
+        # Get the handles that we need to talk to
+        characteristicRead = serviceNotify.getCharacteristics(CHARACTERISTIC_READ_UUID)[0]
+        self.handleRead = characteristicRead.getHandle()
+        log.info('Read characteristic: {}, handle {:x}'.format(characteristicRead, self.handleRead))
+        descriptors = characteristicRead.getDescriptors(forUUID=CCCD_UUID)
+        self.handleNotify = descriptors[0].handle if descriptors else DEFAULT_NOTIFY_HANDLE
+        log.info('Notify handle {:x}'.format(self.handleNotify))
+        if self.handleCache is not None:
+            self.handleCache.put(self.jkbms.mac, self.handleRead, self.handleNotify)
+
+    def enableNotifications(self):
+        log.info('Enable notify handle {}'.format(self.device.writeCharacteristic(self.handleNotify, b'\x01\x00')))
+        log.info('Enable read handle {}'.format(self.device.writeCharacteristic(self.handleRead, b'\x01\x00')))
+
+    def start(self):
+        '''
+        Enable notifications, using cached handles if available
+        '''
+        from bluepy import btle
+
+        cached = self.handleCache.get(self.jkbms.mac) if self.handleCache is not None else None
+        if cached is not None:
+            self.handleRead = cached['read']
+            self.handleNotify = cached['notify']
+            try:
+                self.enableNotifications()
+                return
+            except btle.BTLEException as e:
+                # Stale cache (e.g. firmware update), fall back to discovery
+                log.info('Cached handles of {} invalid: {}'.format(self.jkbms.name, e))
+                self.handleCache.invalidate(self.jkbms.mac)
+        self.discover()
+        self.enableNotifications()
+
+    def write(self, command):
+        return self.device.writeCharacteristic(self.handleRead, command)
+
+    def waitForNotifications(self, timeout):
+        return self.device.waitForNotifications(timeout)
+
+    def disconnect(self):
+        self.device.disconnect()
+        self.disconnectedAt = time.monotonic()
+
+
+class SerialTransport:
+    '''
+    Serial / RS485 transport (needs pyserial)
+    - for BMS (or UART bridges) that answer the getInfo / getCellInfo commands with the same
+      55aaeb90 framed records as sent via BLE, received bytes are fed to the delegate unchanged
+    '''
+
+    def __init__(self, jkbms, port='/dev/ttyUSB0', baudrate=115200, **options):
+        self.jkbms = jkbms
+        self.port = port
+        self.baudrate = int(baudrate)
+        self.serial = None
+        self.delegate = None
+
+    def connect(self, delegate):
+        import serial
+
+        self.delegate = delegate
+        log.info('Opening {} at {} baud for {}'.format(self.port, self.baudrate, self.jkbms.name))
+        try:
+            self.serial = serial.Serial(self.port, self.baudrate, timeout=0)
+        except serial.SerialException as e:
+            log.warning('Cannot open {} for {}: {}'.format(self.port, self.jkbms.name, e))
+            return False
+        return True
+
+    def start(self):
+        self.serial.reset_input_buffer()
+
+    def write(self, command):
+        return self.serial.write(command)
+
+    def waitForNotifications(self, timeout):
+        self.serial.timeout = timeout
+        data = self.serial.read(1)
+        if not data:
+            return False
+        data += self.serial.read(self.serial.in_waiting)
+        self.delegate.handleNotification(0, data)
+        return True
+
+    def disconnect(self):
+        self.serial.close()
+
+
+def mappingOffsets(mapping):
+    '''
+    Return {name: (offset, format, size)} of a mapping table, hidden fields without the '-' prefix
+    '''
+    offsets = {}
+    offset = 0
+    for fmt, size, name, *_ in mapping:
+        offsets[name.lstrip('-')] = (offset, fmt, size)
+        offset += size
+    return offsets
+
+
+class SimulatedTransport:
+    '''
+    Simulated JK BMS for load and soak tests without a Bluetooth adapter
+    - answers getInfo with one info record (0x03)
+    - after getCellInfo streams cell data records (0x02) at rate records per second
+    - records are delivered in notifications of mtu bytes like the BLE transport
+    - the frame layout follows the simulated firmware version like on a real BMS
+    '''
+    frameLength = 300
+    deviceModel = 'JK_B2A24S15P'
+
+    def __init__(self, jkbms, rate=1.0, cells=16, mtu=128, firmware='11.26', **options):
+        self.jkbms = jkbms
+        self.rate = float(rate)
+        self.cells = int(cells)
+        self.firmware = firmware
+        protocol = selectProtocol(self.deviceModel, firmware)
+        self.cellOffsets = mappingOffsets(protocol.cellInfoMapping)
+        self.infoOffsets = mappingOffsets(protocol.infoMapping)
+        maxCells = protocol.cellInfoDecoder.maxCells
+        if not 1 <= self.cells <= maxCells:
+            raise ValueError('Simulated cell count must be 1..{} for layout {}, got {}'.format(maxCells, protocol.name, cells))
+        self.mtu = int(mtu)
+        self.delegate = None
+        self.pending = []
+        self.streaming = False
+        self.nextFrame = 0
+        self.counter = 0
+
+    def connect(self, delegate):
+        self.delegate = delegate
+        log.info('Connected to simulated BMS {} ({} cells, {} records/s)'.format(self.jkbms.name, self.cells, self.rate))
+        return True
+
+    def start(self):
+        pass
+
+    def write(self, command):
+        if command[COMMAND_TYPE_OFFSET] == REQUEST_INFO:
+            self.pending.append(self.infoFrame())
+        elif command[COMMAND_TYPE_OFFSET] == REQUEST_CELL_DATA:
+            self.streaming = True
+            self.nextFrame = time.monotonic()
+        return True
+
+    def waitForNotifications(self, timeout):
+        if not self.pending and self.streaming:
+            delay = self.nextFrame - time.monotonic()
+            if delay > timeout:
+                time.sleep(timeout)
+                return False
+            if delay > 0:
+                time.sleep(delay)
+            self.pending.append(self.cellFrame())
+            self.nextFrame += 1 / self.rate
+        if not self.pending:
+            time.sleep(timeout)
+            return False
+        frame = self.pending.pop(0)
+        for i in range(0, len(frame), self.mtu):
+            self.delegate.handleNotification(0, frame[i:i + self.mtu])
+        return True
+
+    def disconnect(self):
+        self.streaming = False
+        self.pending = []
+
+    def pack(self, frame, offsets, name, value):
+        offset, fmt, size = offsets[name]
+        if fmt == DATA_ASCII:
+            frame[offset:offset + size] = value.encode('ascii')[:size].ljust(size, b'\x00')
+        elif fmt in ('Hex2Str', 'uptime'):
+            frame[offset:offset + size] = int(value).to_bytes(size, 'little')
+        else:
+            fmt_split = fmt.split(":")
+            if len(fmt_split) > 1:
+                value = round(value * int(fmt_split[1].split("/")[1]))
+            struct.pack_into(fmt_split[0], frame, offset, value)
+
+    def finish(self, frame, recordType):
+        frame[0:len(SOR)] = SOR
+        frame[len(SOR)] = recordType
+        frame[-1] = crc8(frame[:-1])
+        return bytes(frame)
+
+    def infoFrame(self):
+        frame = bytearray(self.frameLength)
+        for name, value in (
+            ('DeviceModel', self.deviceModel),
+            ('HardwareVersion', '11.XW'),
+            ('SoftwareVersion', self.firmware),
+            ('Uptime', int(time.monotonic())),
+            ('PowerOnTimes', 7),
+            ('DeviceName', 'SIM-{}'.format(self.jkbms.name)[:16]),
+            ('ManufacturingDate', '230101'),
+            ('SerialNumber', 'SIM0000001'),
+        ):
+            self.pack(frame, self.infoOffsets, name, value)
+        return self.finish(frame, 0x03)
+
+    def cellFrame(self):
+        self.counter += 1
+        frame = bytearray(self.frameLength)
+        phase = self.counter / 60
+        current = 20 * math.sin(phase)
+        voltages = [3.300 + 0.002 * math.sin(phase + i) + random.uniform(-0.001, 0.001) for i in range(self.cells)]
+        voltage = sum(voltages)
+        values = [
+            ('Record_Counter', self.counter & 0xff),
+            ('EnabledCellsBitmask', (1 << self.cells) - 1),
+            ('AverageCellVoltage', voltage / self.cells),
+            ('DeltaCellVoltage', max(voltages) - min(voltages)),
+            ('BatteryVoltage', voltage),
+            ('BatteryPower', abs(voltage * current)),
+            ('BatteryCurrent', current),
+            ('BatteryT1', 21.5),
+            ('BatteryT2', 22.0),
+            ('MOSTemp', 25.3),
+            ('PercentRemain', 80),
+            ('CapacityRemain', 224.0),
+            ('NominalCapacity', 280.0),
+            ('CycleCount', 42),
+            ('CycleCapacity', 11760.0),
+            ('Uptime', self.counter),
+            ('CurrentCharge', max(current, 0)),
+            ('CurrentDischarge', max(-current, 0)),
+        ]
+        for i, cellVoltage in enumerate(voltages):
+            values.append(('VoltageCell{:02d}'.format(i + 1), cellVoltage))
+            values.append(('ResistanceCell{:02d}'.format(i + 1), 0.05))
+        for name, value in values:
+            self.pack(frame, self.cellOffsets, name, value)
+        return self.finish(frame, 0x02)
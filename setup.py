@@ -89,6 +89,8 @@ setup(
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage'],
+        'serial': ['pyserial'],
+        'bleak': ['bleak'],
     },
 
     # To provide executable scripts, use entry points in preference to the
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('bleak')
+
+from bleak.exc import BleakError  # noqa: E402
+
+from jkbms import asyncble  # noqa: E402
+from jkbms.jkbms import jkBMS  # noqa: E402
+from jkbms.transport import Backoff  # noqa: E402
+
+
+class FlakyClient:
+    '''
+    BleakClient that fails every other connect and drops the link right after subscribing
+    '''
+    connects = []
+
+    def __init__(self, mac, disconnected_callback=None, timeout=None, **options):
+        self.disconnectedCallback = disconnected_callback
+        self.is_connected = False
+
+    async def connect(self):
+        FlakyClient.connects.append(asyncio.get_running_loop().time())
+        if len(FlakyClient.connects) % 2:
+            raise BleakError('not found')
+        self.is_connected = True
+
+    async def start_notify(self, characteristic, callback):
+        self.is_connected = False
+        self.disconnectedCallback(self)
+
+    async def write_gatt_char(self, characteristic, payload, response=False):
+        pass
+
+    async def disconnect(self):
+        self.is_connected = False
+
+
+def test_backoff_between_connects_and_lost_sessions(monkeypatch):
+    monkeypatch.setattr(asyncble, 'BleakClient', FlakyClient)
+    FlakyClient.connects = []
+    jk = jkBMS(name='test', model=None, mac='C8:47:8C:00:00:01', command=None, tag='Test', format='topics', daemon=True)
+    supervisor = asyncble.AsyncSupervisor([jk], daemon=True, backoff=Backoff(0.1, 0.1))
+
+    async def run():
+        try:
+            await asyncio.wait_for(supervisor.runDevice(jk), 1.0)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(run())
+    gaps = [b - a for a, b in zip(FlakyClient.connects, FlakyClient.connects[1:])]
+    # A failed attempt and a session lost before any record are both followed by a backoff delay
+    assert 2 <= len(FlakyClient.connects) <= 20
+    assert min(gaps) >= 0.05
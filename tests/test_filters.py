@@ -0,0 +1,23 @@
+from jkbms.filters import Aggregator
+from jkbms.protocol import getProtocol
+
+
+def test_spike_in_skipped_window_published():
+    aggregator = Aggregator(1, frequencies={'BatteryT1': 5})
+    summaries = []
+    for window in range(6):
+        # The spike is in window 2, BatteryT1 is only summarized in windows 0 and 5
+        value = 80.0 if window == 2 else 20.0
+        aggregator.add({'BatteryT1': value, 'BatteryVoltage': 52.0}, window)
+        summaries.append(aggregator.add({'BatteryT1': 20.0, 'BatteryVoltage': 52.0}, window + 1))
+    assert [('BatteryT1Max' in summary) for summary in summaries] == [True, False, False, False, False, True]
+    assert all('BatteryVoltageMax' in summary for summary in summaries)
+    assert summaries[5]['BatteryT1Max'] == 80.0
+    assert summaries[5]['BatteryT1Min'] == 20.0
+
+
+def test_summary_fields_every_window():
+    decoder = getProtocol().cellInfoDecoder
+    fields = Aggregator.summaryFields(decoder.fields, decoder.types)
+    assert {frequency for _, _, frequency in fields} == {1}
+    assert 'VoltageCell01Max' in {name for name, _, _ in fields}
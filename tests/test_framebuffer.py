@@ -0,0 +1,116 @@
+import random
+
+import pytest
+
+from jkbms.framebuffer import SOR, FrameBuffer
+from jkbms.jkbmsdecode import crc8
+from jkbms.transport import SimulatedTransport
+
+
+class Device:
+    name = 'test'
+
+
+def makeFrame(length, recordType=2, fill=0x11):
+    '''
+    Frame of length bytes with a valid trailing checksum
+    '''
+    data = SOR + bytes([recordType, 1]) + bytes([fill]) * (length - len(SOR) - 3)
+    return data + bytes([crc8(data)])
+
+
+def noise(rng, size):
+    # No 0x55 bytes, the noise never contains a SOR
+    return bytes(rng.choice(range(0x56, 0x100)) for _ in range(size))
+
+
+def feed(frames, data, chunks, recordTypes=None):
+    '''
+    Append data split at the chunk boundaries, collect every frame returned
+    '''
+    result = []
+    position = 0
+    for size in chunks:
+        frames.append(data[position:position + size])
+        position += size
+        while True:
+            frame = frames.frame(recordTypes)
+            if frame is None:
+                break
+            result.append(bytes(frame))
+    assert position >= len(data)
+    return result
+
+
+def randomChunks(rng, size, low=1, high=40):
+    chunks = []
+    while sum(chunks) < size:
+        chunks.append(rng.randint(low, high))
+    return chunks
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_splits_with_noise(seed):
+    rng = random.Random(seed)
+    sim = SimulatedTransport(Device())
+    expected = [sim.infoFrame()] + [sim.cellFrame() for _ in range(10)]
+    data = b''.join(noise(rng, rng.randint(0, 30)) + frame for frame in expected)
+    frames = FrameBuffer()
+    assert feed(frames, data, randomChunks(rng, len(data))) == expected
+    assert frames.checksumFailures == 0
+
+
+@pytest.mark.parametrize('length', [100, 300, 320])
+def test_frame_lengths(length):
+    frame = makeFrame(length)
+    frames = FrameBuffer()
+    assert feed(frames, frame, [20] * (length // 20)) == [frame]
+    assert len(frames) == 0
+
+
+def test_bytes_after_frame_kept():
+    first, second = makeFrame(300, fill=0x11), makeFrame(300, fill=0x22)
+    data = first + second
+    frames = FrameBuffer()
+    # The first append ends in the middle of the second frame
+    assert feed(frames, data[:350], [350]) == [first]
+    assert len(frames) == 50
+    assert feed(frames, data[350:], [250]) == [second]
+
+
+def test_resync_on_record_type():
+    info, cell = makeFrame(300, recordType=3), makeFrame(300, recordType=2)
+    frames = FrameBuffer()
+    assert feed(frames, info + cell, [20] * 30, recordTypes={2}) == [cell]
+    assert frames.resyncs == 1
+
+
+def test_resync_on_bad_checksum():
+    bad = bytearray(makeFrame(320, fill=0x11))
+    bad[-1] ^= 0xff
+    good = makeFrame(300, fill=0x22)
+    frames = FrameBuffer()
+    assert feed(frames, bytes(bad) + good, [20] * 31) == [good]
+    assert frames.checksumFailures == 1
+
+
+def test_compaction():
+    rng = random.Random(1)
+    expected = [makeFrame(300, fill=n) for n in range(20)]
+    data = b''.join(noise(rng, 3) + frame for frame in expected)
+    # Chunks never line up with frame ends, the leftover is moved to the start of the buffer
+    frames = FrameBuffer(capacity=640)
+    assert feed(frames, data, randomChunks(rng, len(data), 50, 120)) == expected
+    assert len(frames.buffer) == 640
+    assert frames.overflows == 0
+
+
+def test_overflow():
+    rng = random.Random(2)
+    frame = makeFrame(300)
+    frames = FrameBuffer(capacity=640)
+    # Data without a SOR that is never consumed, followed by a frame
+    frames.append(SOR + noise(rng, 600))
+    frames.append(noise(rng, 100))
+    assert frames.overflows == 1
+    assert feed(frames, frame, [20] * 15) == [frame]
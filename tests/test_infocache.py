@@ -0,0 +1,30 @@
+import io
+
+from jkbms.cache import InfoCache
+from jkbms.jkbms import jkBMS, jkBmsDelegate
+from jkbms.publishMqtt import StreamPublisher
+from jkbms.transport import SimulatedTransport
+
+
+class Device:
+    name = 'test'
+
+
+def identityLines(cache, frames):
+    '''
+    Identity lines published by a new process (jkBMS) for the info frames
+    '''
+    stream = io.StringIO()
+    jk = jkBMS(name='test', model=None, mac='C8:47:8C:00:00:01', command=None, tag='Test', format='topics', transport='sim', publisher=StreamPublisher(stream), infoCache=cache)
+    delegate = jkBmsDelegate(jk)
+    for frame in frames:
+        delegate.processRecord(frame)
+    return [line for line in stream.getvalue().splitlines() if line.startswith('Test/CellData/DeviceModel ')]
+
+
+def test_identity_published_once_per_process(tmp_path):
+    cache = InfoCache(str(tmp_path / 'info.json'))
+    frame = SimulatedTransport(Device()).infoFrame()
+    assert len(identityLines(cache, [frame, frame])) == 1
+    # Cached identity, a new process still publishes it once
+    assert len(identityLines(cache, [frame, frame])) == 1
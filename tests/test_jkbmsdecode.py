@@ -0,0 +1,137 @@
+import os
+import random
+
+import pytest
+
+from jkbms.jkbms_mapping import CellArrays, InfoResponseMapping
+from jkbms.jkbmsdecode import DATA_ASCII, DecodeFormat, Hex2Ascii, Hex2Str, RecordDecoder, crc8, uptime
+from jkbms.protocol import PROTOCOLS, getProtocol
+from jkbms.transport import SimulatedTransport
+
+
+# Former per-byte implementations, the bulk helpers must return exactly the same
+def hex2AsciiLoop(hexString):
+    answer = ""
+    for x in hexString:
+        if x != 0:
+            answer += f"{x:c}"
+    return answer
+
+
+def hex2StrLoop(hexString):
+    answer = ""
+    for x in hexString:
+        answer += f"{x:02x}"
+    return answer
+
+
+def uptimeLoop(byteData):
+    value = 0
+    for x, b in enumerate(byteData):
+        value += b * 256 ** x
+    return value
+
+
+def convertFields(mapping, record):
+    '''
+    Former field by field decoding (jkBmsDelegate.convertField), published fields only
+    '''
+    fields = {}
+    offset = 0
+    for fmt, size, name, unit, *opts in mapping:
+        data = record[offset:offset + size]
+        offset += size
+        if name[0] == '-' or fmt == "discard":
+            continue
+        if fmt == "Hex2Str":
+            value = Hex2Str(data)
+        elif fmt == "uptime":
+            value = uptime(data)
+        elif fmt == DATA_ASCII:
+            value = Hex2Ascii(data)
+        else:
+            fmt_split = fmt.split(":")
+            value = DecodeFormat(fmt_split[0], data)
+            if len(fmt_split) > 1 and fmt_split[1] == "r/1000":
+                value /= 1000
+            if len(fmt_split) > 1 and fmt_split[1] == "r/10":
+                value /= 10
+        fields[name] = value
+    return fields
+
+
+class Device:
+    name = 'test'
+
+
+def frameFields():
+    '''
+    Bytes of the string style fields of simulated cell data and info frames
+    '''
+    sim = SimulatedTransport(Device())
+    fields = []
+    for mapping, frame in ((getProtocol().cellInfoMapping, sim.cellFrame()), (InfoResponseMapping, sim.infoFrame())):
+        for name, _, _, converter, start, stop in RecordDecoder(mapping).steps:
+            if converter is not None:
+                fields.append(frame[start:stop])
+    return fields
+
+
+def corpus():
+    rng = random.Random(25)
+    data = [b'', b'\x00', b'\x00' * 16, bytes(range(256)), bytes(range(255, -1, -1)), b'JK_B2A24S15P\x00\x00\x00\x00', b'\x00\x00JK\x00BMS\x00']
+    data += [bytes([value]) for value in range(256)]
+    data += [bytes(rng.randrange(256) for _ in range(length)) for length in (1, 2, 3, 4, 8, 16, 64, 300)]
+    data += [bytes(rng.choice((0, 0, 0x20, 0x41, 0x7f, 0x80, 0xff)) for _ in range(32)) for _ in range(50)]
+    data += [os.urandom(16) for _ in range(10)]
+    data += frameFields()
+    variants = []
+    for value in data:
+        variants += [value, bytearray(value), memoryview(value), memoryview(b'\xaa' + value + b'\xaa')[1:-1], list(value)]
+    return variants
+
+
+CORPUS = corpus()
+
+
+@pytest.mark.parametrize('helper, reference', [(Hex2Str, hex2StrLoop), (Hex2Ascii, hex2AsciiLoop), (uptime, uptimeLoop)], ids=['Hex2Str', 'Hex2Ascii', 'uptime'])
+def test_bulk_helpers_match_loops(helper, reference):
+    for value in CORPUS:
+        expected = reference(value)
+        actual = helper(value)
+        assert actual == expected and type(actual) is type(expected), bytes(value)
+
+
+def test_examples():
+    assert Hex2Str(b'\x4a\x00\xff') == '4a00ff'
+    assert Hex2Ascii(b'JK\x00\x00BMS\x00') == 'JKBMS'
+    assert Hex2Ascii(b'\xb0C') == '\xb0C'
+    assert uptime(b'\x01\x02\x03') == 0x030201
+    assert uptime(b'') == 0
+
+
+def test_crc8():
+    assert crc8(b'') == 0
+    assert crc8(b'\xff\x02') == 1
+
+
+def isCellField(name):
+    return any(name.startswith(prefix) and name[len(prefix):].isdigit() for prefix in CellArrays)
+
+
+@pytest.mark.parametrize('name', sorted(PROTOCOLS))
+def test_decoders_match_convertField(name):
+    protocol = PROTOCOLS[name]
+    rng = random.Random(1)
+    sim = SimulatedTransport(Device())
+    frames = [bytes(rng.randrange(256) for _ in range(320)) for _ in range(200)] + [sim.cellFrame(), sim.infoFrame()]
+    for record in frames:
+        for mapping, decoder in ((protocol.cellInfoMapping, protocol.cellInfoDecoder), (protocol.infoMapping, protocol.infoDecoder)):
+            expected = convertFields(mapping, record)
+            actual = decoder.decode(record)
+            for field, value in expected.items():
+                if field not in actual:
+                    # Only the cells beyond the enabled cell count are left out
+                    assert isCellField(field), field
+                    continue
+                assert actual[field] == value and type(actual[field]) is type(value), (name, field)
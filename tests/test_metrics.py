@@ -0,0 +1,34 @@
+from jkbms.metrics import DeviceMetrics
+
+
+class Counters:
+    resyncs = 0
+    checksumFailures = 0
+    overflows = 0
+    depth = 0
+
+    def __init__(self, dropped):
+        self.dropped = dropped
+
+
+class Delegate:
+    def __init__(self, dropped):
+        self.frames = Counters(0)
+        self.worker = Counters(dropped)
+
+
+class Device:
+    tag = 'Test'
+    transport = None
+
+
+def renderedValue(metrics, name):
+    return [line.split()[-1] for line in metrics.render() if line.startswith(name + '{')][0]
+
+
+def test_dropped_cumulative_over_sessions():
+    metrics = DeviceMetrics(Device())
+    metrics.attach(Delegate(dropped=3))
+    assert renderedValue(metrics, 'jkbms_records_dropped_total') == '3'
+    metrics.attach(Delegate(dropped=2))
+    assert renderedValue(metrics, 'jkbms_records_dropped_total') == '5'
@@ -0,0 +1,29 @@
+import pytest
+
+from jkbms.protocol import getProtocol, modelCells, selectProtocol
+
+
+@pytest.mark.parametrize('model, cells', [
+    ('JK_B2A24S15P', 24),
+    ('JK-B2A32S', 32),
+    ('jk-bd6a20s10p', 20),
+    ('', None),
+])
+def test_modelCells(model, cells):
+    assert modelCells(model) == cells
+
+
+@pytest.mark.parametrize('model, firmware, layout', [
+    # info record
+    ('JK_B2A24S15P', '11.XW', 'JK02_32S'),
+    ('JK_B2A24S15P', '10.XW', 'JK02_24S'),
+    ('JK_B2A32S20P', '10.XW', 'JK02_32S'),
+    ('JK_PB2A16S20P', '10.XW', 'JK02_32S'),
+    # configured model only
+    ('JK-B2A24S', None, getProtocol().name),
+    ('JK-B2A32S', None, 'JK02_32S'),
+    ('JK-PB2A16S', None, 'JK02_32S'),
+    (None, None, getProtocol().name),
+])
+def test_selectProtocol(model, firmware, layout):
+    assert selectProtocol(model, firmware).name == layout
@@ -0,0 +1,63 @@
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('paho.mqtt.client')
+
+from jkbms.publishMqtt import MqttPublisher  # noqa: E402
+
+
+def fakeBroker(delay):
+    '''
+    Accepts one MQTT connection and answers the CONNECT with a CONNACK after delay seconds
+    '''
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+
+    def serve():
+        connection, _ = server.accept()
+        connection.recv(1024)
+        time.sleep(delay)
+        connection.sendall(b'\x20\x02\x00\x00')
+        time.sleep(1)
+        connection.close()
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def test_connect_waits_for_connack():
+    publisher = MqttPublisher('127.0.0.1', port=fakeBroker(0.3), connectTimeout=5)
+    publisher.connect()
+    try:
+        assert publisher.connected
+        assert publisher.multiple([{'topic': 'Test/CellData', 'payload': '1'}]) == 1
+        assert publisher.failed == 0
+    finally:
+        publisher.close()
+
+
+def test_connect_timeout():
+    publisher = MqttPublisher('127.0.0.1', port=fakeBroker(5), connectTimeout=0.2)
+    start = time.monotonic()
+    publisher.connect()
+    try:
+        assert time.monotonic() - start < 2
+        assert not publisher.connected
+    finally:
+        publisher.close()
+
+
+def test_disconnected_qos():
+    msgs = [{'topic': 'Test/CellData', 'payload': str(n)} for n in range(3)]
+    # QoS 0 is dropped by paho while disconnected, the caller keeps (spools) them
+    assert MqttPublisher('127.0.0.1', qos=0).multiple(msgs) == 0
+    # QoS 1 is queued by paho and resent after the reconnect, spooling it would duplicate it
+    assert MqttPublisher('127.0.0.1', qos=1).multiple(msgs) == 3
+    publisher = MqttPublisher('127.0.0.1', qos=1, maxQueued=2)
+    assert publisher.multiple(msgs) == 2
+    assert publisher.failed == 1
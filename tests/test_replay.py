@@ -0,0 +1,51 @@
+import os
+
+from jkbms.replay import decodeHex, replay
+from jkbms.transport import SimulatedTransport
+
+NOTIFICATION_SIZE = 20
+
+
+class Device:
+    name = 'test'
+
+
+def writeCapture(path, frames):
+    '''
+    Write frames as a hex capture, split in notification sized lines with noise in between
+    '''
+    data = b'\x01\x02\x03'.join(frames)
+    with open(path, 'w') as f:
+        f.write('# test capture\n')
+        for i in range(0, len(data), NOTIFICATION_SIZE):
+            f.write(data[i:i + NOTIFICATION_SIZE].hex() + '\n')
+
+
+def simFrames(cellFrames=5):
+    sim = SimulatedTransport(Device())
+    return [sim.infoFrame()] + [sim.cellFrame() for _ in range(cellFrames)]
+
+
+def test_replay_decodes_every_frame(tmp_path):
+    capture = str(tmp_path / 'capture.hex')
+    writeCapture(capture, simFrames(5))
+    frames, _ = replay([capture], output=os.devnull)
+    assert frames == 6
+
+
+def test_replay_writes_messages(tmp_path):
+    capture = str(tmp_path / 'capture.hex')
+    output = str(tmp_path / 'replay.txt')
+    writeCapture(capture, simFrames(3))
+    replay([capture], output=output, tag='Test')
+    with open(output) as f:
+        lines = f.read().splitlines()
+    assert 'Test/CellData/DeviceModel JK_B2A24S15P' in lines
+    assert sum(line.startswith('Test/CellData/BatteryVoltage_V ') for line in lines) == 3
+
+
+def test_decode_hex():
+    results = decodeHex(b''.join(simFrames(2)).hex())
+    assert len(results) == 3
+    assert results[0]['DeviceModel'] == 'JK_B2A24S15P'
+    assert results[1]['CellCount'] == 16
@@ -0,0 +1,103 @@
+from jkbms.scheduler import Command, CommandScheduler
+
+INFO = 3
+CELL = 2
+
+
+class Delegate:
+    def __init__(self):
+        self.record_types = None
+        self.received = [0] * 256
+
+
+class Ready:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+
+
+def scheduler(*commands):
+    delegate = Delegate()
+    scheduler = CommandScheduler(None, delegate, list(commands))
+    scheduler.start(0)
+    return scheduler, delegate
+
+
+def name(step):
+    command, _ = step
+    return command.name if command is not None else None
+
+
+def test_priority_and_answer():
+    cell = Command('getCellInfo', b'cell', CELL, priority=1, stream=True)
+    info = Command('getInfo', b'info', INFO, priority=0)
+    jk, delegate = scheduler(cell, info)
+    assert delegate.record_types == frozenset()
+    assert name(jk.step(0)) == 'getInfo'
+    assert delegate.record_types == {INFO}
+    # Nothing else is sent while the active command waits for its answer
+    assert name(jk.step(1)) is None
+    delegate.received[INFO] += 1
+    assert name(jk.step(1.1)) == 'getCellInfo'
+    assert delegate.record_types == {INFO, CELL}
+
+
+def test_timeout_retry_give_up():
+    info = Command('getInfo', b'info', INFO, timeout=5, retries=2)
+    jk, delegate = scheduler(info)
+    assert name(jk.step(0)) == 'getInfo'
+    command, timeout = jk.step(1)
+    assert command is None and timeout == 1.0
+    assert name(jk.step(5)) == 'getInfo'
+    assert jk.attempt == 1
+    assert name(jk.step(10)) == 'getInfo'
+    assert jk.attempt == 2
+    # Out of retries, not sent again
+    assert name(jk.step(15)) is None
+    assert name(jk.step(100)) is None
+    assert (jk.sent, jk.timeouts) == (3, 3)
+
+
+def test_periodic_reissue():
+    info = Command('getInfo', b'info', INFO, interval=60)
+    jk, delegate = scheduler(info)
+    assert name(jk.step(0)) == 'getInfo'
+    delegate.received[INFO] += 1
+    assert name(jk.step(1)) is None
+    assert name(jk.step(60)) is None
+    assert name(jk.step(61)) == 'getInfo'
+
+
+def test_stream_reissue():
+    cell = Command('getCellInfo', b'cell', CELL, stream=True, streamTimeout=10)
+    jk, delegate = scheduler(cell)
+    assert name(jk.step(0)) == 'getCellInfo'
+    delegate.received[CELL] += 1
+    assert name(jk.step(1)) is None
+    # Records keep arriving, the stream is alive
+    for now in range(2, 20):
+        delegate.received[CELL] += 1
+        assert name(jk.step(now)) is None
+    # No record for streamTimeout seconds after the last one (seen at 19)
+    assert name(jk.step(28)) is None
+    assert name(jk.step(29)) == 'getCellInfo'
+
+
+def test_on_ready_once():
+    info = Command('getInfo', b'info', INFO, interval=60)
+    cell = Command('getCellInfo', b'cell', CELL, priority=1, stream=True)
+    jk, delegate = scheduler(info, cell)
+    ready = Ready()
+    jk.step(0, onReady=ready)
+    delegate.received[INFO] += 1
+    jk.step(1, onReady=ready)
+    assert ready.calls == 0
+    delegate.received[CELL] += 1
+    jk.step(2, onReady=ready)
+    assert ready.calls == 1 and jk.ready
+    delegate.received[INFO] += 1
+    jk.step(61, onReady=ready)
+    jk.step(62, onReady=ready)
+    assert ready.calls == 1
@@ -0,0 +1,81 @@
+import time
+
+from jkbms.spool import Spool, SpoolingPublisher
+
+
+class FlakyPublisher:
+    '''
+    Hands over at most limit messages per call (None: all), like MqttPublisher when the link drops mid batch
+    '''
+
+    def __init__(self):
+        self.connected = True
+        self.limit = None
+        self.received = []
+
+    def connect(self):
+        pass
+
+    def multiple(self, msgs):
+        sent = len(msgs) if self.limit is None else min(self.limit, len(msgs))
+        self.received.extend(msg['topic'] for msg in msgs[:sent])
+        if self.limit is not None:
+            self.limit -= sent
+        return sent
+
+    def close(self):
+        pass
+
+
+def messages(first, count):
+    return [{'topic': 't{}'.format(i), 'payload': i} for i in range(first, first + count)]
+
+
+def test_commit_of_evicted_segment(tmp_path):
+    spool = Spool(str(tmp_path), segmentSize=256, maxBytes=512)
+    spool.append(messages(0, 3))
+    msgs, token = spool.peek()
+    # Fills the spool, the segment of token is evicted
+    for i in range(10):
+        spool.append(messages(10 * i, 3))
+    assert spool.evicted
+    assert spool.commit(token) is False
+    assert spool.peek() is not None
+    spool.close()
+
+
+def test_partial_publish_is_not_duplicated(tmp_path):
+    publisher = FlakyPublisher()
+    spooling = SpoolingPublisher(publisher, Spool(str(tmp_path)), drainRate=100000)
+    publisher.limit = 2
+    spooling.multiple(messages(0, 5))
+    spooling.multiple(messages(5, 5))
+    assert publisher.received == ['t0', 't1']
+    assert spooling.spooled == 8
+    publisher.limit = None
+    spooling.connect()
+    deadline = time.monotonic() + 5
+    while len(publisher.received) < 10 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    spooling.close()
+    assert publisher.received == ['t{}'.format(i) for i in range(10)]
+
+
+def test_partly_drained_batch_resumes(tmp_path):
+    publisher = FlakyPublisher()
+    publisher.connected = False
+    spooling = SpoolingPublisher(publisher, Spool(str(tmp_path)), drainRate=100000)
+    spooling.multiple(messages(0, 4))
+    spooling.multiple(messages(4, 2))
+    publisher.connected = True
+    publisher.limit = 3
+    spooling.connect()
+    deadline = time.monotonic() + 5
+    while spooling.pending is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert publisher.received == ['t0', 't1', 't2']
+    publisher.limit = None
+    while len(publisher.received) < 6 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    spooling.close()
+    assert publisher.received == ['t{}'.format(i) for i in range(6)]
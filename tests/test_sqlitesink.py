@@ -0,0 +1,35 @@
+import sqlite3
+import time
+
+from jkbms.protocol import getProtocol
+from jkbms.publishMqtt import fieldKey
+from jkbms.sqlitesink import SqliteSink
+
+
+def test_table_shared_by_layouts(tmp_path):
+    path = str(tmp_path / 'jkbms.db')
+    sink = SqliteSink(path, batchSize=100)
+    decoders = [getProtocol('JK02_24S').cellInfoDecoder, getProtocol('JK02_32S').cellInfoDecoder]
+    for device, decoder in zip(('bms24', 'bms32'), decoders):
+        fields = {name: (1 if decoder.types[name] is int else 'x' if decoder.types[name] is str else 1.5) for name, _, _ in decoder.fields}
+        sink.write(device, 'CellData', decoder, fields, time.time())
+    sink.close()
+    connection = sqlite3.connect(path)
+    columns = {row[1] for row in connection.execute('PRAGMA table_info("CellData")')}
+    for decoder in decoders:
+        assert {fieldKey(name, unit) for name, unit, _ in decoder.fields} <= columns
+    # Fields only the 32 cell layout has are stored for the 32 cell device
+    column = fieldKey(*[(name, unit) for name, unit, _ in decoders[1].fields if name == 'ResistanceCell25'][0])
+    rows = dict(connection.execute('SELECT device, "{}" FROM CellData'.format(column)))
+    assert rows == {'bms24': None, 'bms32': 1.5}
+
+
+def test_flush_interval_without_records(tmp_path):
+    path = str(tmp_path / 'jkbms.db')
+    sink = SqliteSink(path, batchSize=100, flushInterval=0.2)
+    decoder = getProtocol().infoDecoder
+    sink.write('bms', 'Info', decoder, {}, time.time())
+    # No further record arrives, the queued row is still written
+    time.sleep(0.6)
+    assert sqlite3.connect(path).execute('SELECT COUNT(*) FROM Info').fetchone()[0] == 1
+    sink.close()
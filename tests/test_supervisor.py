@@ -0,0 +1,48 @@
+import threading
+import time
+
+from jkbms.supervisor import Supervisor, Watchdog
+
+
+class Device:
+    def __init__(self, name, heartbeat=0):
+        self.name = name
+        self.heartbeat = heartbeat
+        self.delegate = None
+        self.done = threading.Event()
+
+    def connect(self):
+        self.done.wait(1)
+        return False
+
+
+def test_thread_names_unique():
+    devices = [Device('bms'), Device('bms'), Device('other')]
+    supervisor = Supervisor(devices)
+    supervisor.start()
+    for jk in devices:
+        jk.done.set()
+    supervisor.join()
+    assert [thread.name for thread in supervisor.threads] == ['jkbms-bms', 'jkbms-bms-2', 'jkbms-other']
+
+
+def test_watchdog_stale_device():
+    now = time.monotonic()
+    alive, dead = Device('alive', now), Device('dead', now - 120)
+    watchdog = Watchdog([alive, dead], maxAge=60)
+    assert watchdog.stale(now) == [dead]
+    # One silent device does not restart the service
+    assert watchdog.healthy(now)
+    dead.heartbeat = now
+    assert watchdog.stale(now) == []
+
+
+def test_watchdog_unhealthy():
+    now = time.monotonic()
+    devices = [Device('a', now - 120), Device('b', now - 120)]
+    assert not Watchdog(devices, maxAge=60).healthy(now)
+    thread = threading.Thread(target=lambda: None, name='jkbms-a')
+    thread.start()
+    thread.join()
+    devices[0].heartbeat = now
+    assert not Watchdog(devices, threads=[thread], maxAge=60).healthy(now)